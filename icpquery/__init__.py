@@ -1,14 +1,25 @@
-from typing import Callable
+import time
+
+# 包导入开始时间, 供命令行 --profile 统计导入耗时 (导入本包即加载 cv2、numpy、httpx、pydantic 等依赖)
+_import_start = time.perf_counter()
+
+import asyncio
+from typing import AsyncIterator, Callable, Iterable
 
 import httpx
 
+from .coalesce import SingleFlight
+from .deadline import Deadline
 from .dto import AsyncIcpQueryDto
-from .exceptions import ICPHTTPError
-from .schema import BeianQueryResp, SearchType
+from .profiling import profile, stage
+from .exceptions import ICPHTTPError, ICPQueryTimeout
+from .schema import BeianMultiQueryResp, BeianQueryResp, SearchType
 from .utils import resolve_captcha
 
 __version__ = "1.3.0"
 
+_query_flight = SingleFlight()
+
 
 async def icp_query(
     keyword: str,
@@ -16,6 +27,7 @@ async def icp_query(
     captcha_cb: Callable[[int], None] = None,
     captcha_max_retry: int = 10,
     captcha_fail_delay: float = 2.0,
+    timeout: float | None = None,
 ) -> BeianQueryResp:
     """调用ICP查询处理
     Args:
@@ -24,17 +36,160 @@ async def icp_query(
         captcha_cb: 验证码识别回调
         captcha_max_retry: 验证码识别最大重试次数
         captcha_fail_delay: 验证码识别失败重试等待时间
+        timeout: 总耗时预算(秒), 超出时抛出 ICPQueryTimeout, 为None时不限制
+    Returns:
+        BeianQueryResp: 查询结果 (首页, 全部分页使用 icp_query_iter)
+    """
+    deadline = Deadline(timeout)
+    try:
+        async with AsyncIcpQueryDto(deadline=deadline) as dto:
+            with stage("get_token"):
+                await dto.get_token()
+            await resolve_captcha(dto, captcha_cb, captcha_max_retry, captcha_fail_delay)
+            with stage("query"):
+                results = await dto.query(keyword, search_type)
+    except httpx.HTTPError:
+        # 请求因预算耗尽而超时
+        deadline.check()
+        raise ICPHTTPError
+    return results
+
+
+async def icp_query_all(
+    keyword: str,
+    search_types: Iterable[SearchType] = tuple(SearchType),
+    captcha_cb: Callable[[int], None] = None,
+    captcha_max_retry: int = 10,
+    captcha_fail_delay: float = 2.0,
+    timeout: float | None = None,
+) -> BeianMultiQueryResp:
+    """调用ICP查询处理, 一次鉴权与验证码识别后并发查询多种类型
+    Args:
+        keyword: 关键词
+        search_types: 搜索类型列表, 默认全部类型
+        captcha_cb: 验证码识别回调
+        captcha_max_retry: 验证码识别最大重试次数
+        captcha_fail_delay: 验证码识别失败重试等待时间
+        timeout: 总耗时预算(秒), 超出时抛出 ICPQueryTimeout, 为None时不限制
     Returns:
-        BeianQueryResp: 查询结果
+        BeianMultiQueryResp: 查询结果 (各类型首页, 全部分页使用 icp_query_iter)
     """
+    deadline = Deadline(timeout)
     try:
-        async with AsyncIcpQueryDto() as dto:
-            await dto.get_token()
+        async with AsyncIcpQueryDto(deadline=deadline) as dto:
+            with stage("get_token"):
+                await dto.get_token()
             await resolve_captcha(dto, captcha_cb, captcha_max_retry, captcha_fail_delay)
-            results = await dto.query(keyword, search_type)
+            with stage("query"):
+                results = await dto.query_all(keyword, search_types)
     except httpx.HTTPError:
+        # 请求因预算耗尽而超时
+        deadline.check()
         raise ICPHTTPError
     return results
 
 
-__all__ = ["icp_query", "BeianQueryResp", "SearchType"]
+async def icp_query_iter(
+    keyword: str,
+    search_types: Iterable[SearchType] = (SearchType.DOMAIN,),
+    captcha_cb: Callable[[int], None] = None,
+    captcha_max_retry: int = 10,
+    captcha_fail_delay: float = 2.0,
+    page_size: int = 20,
+    timeout: float | None = None,
+) -> AsyncIterator[BeianQueryResp]:
+    """调用ICP查询处理, 逐页返回查询结果
+    一次鉴权与验证码识别后并发查询各类型, 各类型的分页按到达顺序返回 (同一类型内按页码顺序)
+    Args:
+        keyword: 关键词
+        search_types: 搜索类型列表
+        captcha_cb: 验证码识别回调
+        captcha_max_retry: 验证码识别最大重试次数
+        captcha_fail_delay: 验证码识别失败重试等待时间
+        page_size: 每页数量
+        timeout: 总耗时预算(秒), 包含全部分页, 超出时抛出 ICPQueryTimeout, 为None时不限制
+    Returns:
+        AsyncIterator[BeianQueryResp]: 每页查询结果
+    """
+    deadline = Deadline(timeout)
+    try:
+        async with AsyncIcpQueryDto(deadline=deadline) as dto:
+            with stage("get_token"):
+                await dto.get_token()
+            await resolve_captcha(dto, captcha_cb, captcha_max_retry, captcha_fail_delay)
+            queue: asyncio.Queue[BeianQueryResp | None] = asyncio.Queue()
+
+            async def fetch_pages(search_type: SearchType):
+                pages = dto.iter_query(keyword, search_type, page_size)
+                while True:
+                    with stage("query"):
+                        results = await anext(pages, None)
+                    if results is None:
+                        return
+                    queue.put_nowait(results)
+
+            tasks = [asyncio.create_task(fetch_pages(t)) for t in search_types]
+            # 全部类型查询完成或任一类型出错时结束
+            runner = asyncio.gather(*tasks)
+            runner.add_done_callback(lambda _: queue.put_nowait(None))
+            try:
+                while (results := await queue.get()) is not None:
+                    yield results
+                await runner
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(runner, *tasks, return_exceptions=True)
+    except httpx.HTTPError:
+        # 请求因预算耗尽而超时
+        deadline.check()
+        raise ICPHTTPError
+
+
+async def icp_query_coalesced(
+    keyword: str,
+    search_type: SearchType = SearchType.DOMAIN,
+    captcha_max_retry: int = 10,
+    captcha_fail_delay: float = 2.0,
+    timeout: float | None = None,
+) -> BeianQueryResp:
+    """调用ICP查询处理, 合并并发的相同查询
+    同一 (关键词, 搜索类型) 同时只进行一次鉴权、验证码识别与查询, 结果分发给全部调用者;
+    合并的查询使用首个调用者的耗时预算, 每个调用者的等待时间不超过各自的预算
+    Args:
+        keyword: 关键词
+        search_type: 搜索类型
+        captcha_max_retry: 验证码识别最大重试次数
+        captcha_fail_delay: 验证码识别失败重试等待时间
+        timeout: 总耗时预算(秒), 超出时抛出 ICPQueryTimeout, 为None时不限制
+    Returns:
+        BeianQueryResp: 查询结果 (首页, 全部分页使用 icp_query_iter)
+    """
+    try:
+        return await asyncio.wait_for(
+            _query_flight.do(
+                (keyword, search_type),
+                lambda: icp_query(
+                    keyword,
+                    search_type,
+                    captcha_max_retry=captcha_max_retry,
+                    captcha_fail_delay=captcha_fail_delay,
+                    timeout=timeout,
+                ),
+            ),
+            timeout,
+        )
+    except TimeoutError:
+        raise ICPQueryTimeout(timeout)
+
+
+__all__ = [
+    "icp_query",
+    "icp_query_all",
+    "icp_query_coalesced",
+    "icp_query_iter",
+    "BeianQueryResp",
+    "BeianMultiQueryResp",
+    "SearchType",
+    "profile",
+]
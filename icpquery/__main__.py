@@ -1,8 +1,10 @@
 import asyncio
 import inspect
 import sys
+import time
 from enum import StrEnum
 from functools import partial, wraps
+from pathlib import Path
 from typing import Optional
 
 from rich.align import Align
@@ -12,9 +14,30 @@ from rich.panel import Panel
 from rich.progress import Progress, SpinnerColumn, TextColumn
 from rich.table import Table
 from typer import Argument, Context, Option, Typer
+from typer.core import TyperGroup
 
-from icpquery import SearchType, __version__, icp_query
-from icpquery.exceptions import ICPQueryError
+import icpquery
+from icpquery import SearchType, __version__, icp_query_iter
+from icpquery.corpus import CaptchaOutcome
+from icpquery.exceptions import ICPQueryError, ICPQueryTimeout
+from icpquery.profiling import Profiler
+from icpquery.schema import SEARCH_TYPE_NAMES, BeianMultiQueryResp, BeianQueryResp, records_table
+
+# 第三方库与本包导入耗时, 供 --profile 统计;
+# python -m icpquery 与 icpquery 命令均在执行本模块前导入 icpquery 包, 因此从包导入开始计时
+_import_start = icpquery._import_start
+_import_end = time.perf_counter()
+
+
+class DefaultCommandGroup(TyperGroup):
+    "未指定子命令时默认执行 query, 兼容 `icpquery 'baidu.com'` 用法"
+
+    default_command = "query"
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] not in ("--help", "-h")):
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
 
 
 class AsyncTyper(Typer):
@@ -40,7 +63,7 @@ class AsyncTyper(Typer):
         return partial(self.maybe_run_async, decorator)
 
 
-app = AsyncTyper(add_completion=False)
+app = AsyncTyper(cls=DefaultCommandGroup, add_completion=False)
 console = Console(highlight=False)
 
 
@@ -51,6 +74,7 @@ class SearchTypeChoice(StrEnum):
     APP = "app"
     MINI_PROG = "mini_prog"
     FAST_PROG = "fast_prog"
+    ALL = "all"
 
 
 class FormatTypeChoice(StrEnum):
@@ -59,6 +83,32 @@ class FormatTypeChoice(StrEnum):
     TEXT = "text"
 
 
+def start_profile(ctx: Context, profile_file: Path):
+    "启动性能分析, 命令结束时保存结果并输出各阶段耗时"
+    profiler = Profiler()
+    profiler.start()
+    profiler.start_time = _import_start
+    profiler.add_stage("imports", _import_start, _import_end)
+
+    def on_close():
+        profiler.stop()
+        profiler.save(profile_file)
+        wall_time = profiler.end_time - profiler.start_time
+        table = Table(title="各阶段耗时", title_justify="left")
+        table.add_column("阶段")
+        table.add_column("次数", justify="right")
+        table.add_column("耗时(ms)", justify="right")
+        table.add_column("占比", justify="right")
+        for name, (count, total) in profiler.stages.items():
+            table.add_row(name, str(count), f"{total * 1000:.1f}", f"{total / wall_time:.1%}")
+        table.add_row("[bold]总计", "", f"{wall_time * 1000:.1f}", "")
+        err_console = Console(stderr=True, highlight=False)
+        err_console.print(table)
+        err_console.print(f"性能分析结果已保存: {profile_file}")
+
+    ctx.call_on_close(on_close)
+
+
 @app.command(help="查询ICP备案记录")
 async def query(
     ctx: Context,
@@ -84,6 +134,18 @@ async def query(
         "--max-retry",
         help="验证码最大重试次数",
     ),
+    timeout: Optional[float] = Option(
+        None,
+        "--timeout",
+        help="单次查询总耗时预算(秒), 默认不限制",
+        show_default=False,
+    ),
+    profile_file: Optional[Path] = Option(
+        None,
+        "--profile",
+        help="性能分析结果保存路径 (.json 为 speedscope 格式, 其他为火焰图折叠栈格式)",
+        show_default=False,
+    ),
     version: bool = Option(
         False,
         "-V",
@@ -97,6 +159,26 @@ async def query(
     if not keyword:
         ctx.get_help()
         sys.exit(0)
+    if profile_file is not None:
+        start_profile(ctx, profile_file)
+
+    if search_type == SearchTypeChoice.ALL:
+        search_types = list(SearchType)
+    else:
+        search_types = [SearchType[search_type.name]]
+
+    async def run_query() -> BeianQueryResp | BeianMultiQueryResp:
+        "查询全部分页并合并, 与TTY模式输出的记录一致"
+        records = {t: [] for t in search_types}
+        async for results in icp_query_iter(
+            keyword, search_types, captcha_max_retry=captcha_max_retry, timeout=timeout
+        ):
+            records[results.search_type].extend(results.results)
+        responses = [BeianQueryResp(search_type=t, results=r) for t, r in records.items()]
+        if search_type == SearchTypeChoice.ALL:
+            return BeianMultiQueryResp(responses=responses)
+        return responses[0]
+
     if format == FormatTypeChoice.TTY:
         table = Table.grid()
         table.add_row(
@@ -119,27 +201,36 @@ async def query(
         def on_captcha_try(count: int):
             progress.update(progress_task, completed=count + 1)
 
+        # 逐页渲染到Live区域上方, Live区域只保留状态, 渲染开销与内存不随记录总数增长
+        record_cnt = 0
         with Live(table, console=console) as live:
             try:
-                results = await icp_query(
+                async for results in icp_query_iter(
                     keyword,
-                    SearchType[search_type.name],
+                    search_types,
                     captcha_cb=on_captcha_try,
                     captcha_max_retry=captcha_max_retry,
-                )
+                    timeout=timeout,
+                ):
+                    progress.update(progress_task, description="查询中")
+                    if not results:
+                        continue
+                    record_cnt += len(results.results)
+                    progress.update(progress_task, description=f"查询中, 已加载 {record_cnt} 条")
+                    live.console.print(
+                        records_table(
+                            results.search_type,
+                            results.results,
+                            title=f"[green]{SEARCH_TYPE_NAMES[results.search_type]}备案",
+                        )
+                    )
+            except ICPQueryTimeout:
+                live.update("[bold red]ICP查询超时")
             except ICPQueryError:
                 live.update("[bold red]ICP查询失败")
             else:
-                if results:
-                    panel = Panel(results, title_align="left")
-                    if results.search_type == SearchType.DOMAIN:
-                        panel.title = "[green]域名备案查询成功"
-                    elif results.search_type == SearchType.APP:
-                        panel.title = "[green]APP备案查询成功"
-                    else:
-                        raise NotImplementedError
-                    live.stop()
-                    console.print(panel)
+                if record_cnt:
+                    live.update(f"[green]共查询到 {record_cnt} 条备案记录")
                 else:
                     live.update(
                         Panel(
@@ -154,29 +245,196 @@ async def query(
                     )
     elif format == FormatTypeChoice.JSON:
         try:
-            results = await icp_query(
-                keyword,
-                SearchType[search_type.name],
-                captcha_max_retry=captcha_max_retry,
-            )
+            results = await run_query()
         except ICPQueryError as e:
-            sys.stderr.write("ICP查询失败")
+            sys.stderr.write("ICP查询超时" if isinstance(e, ICPQueryTimeout) else "ICP查询失败")
             sys.exit(-1)
         else:
             sys.stdout.write(results.to_json())
     elif format == FormatTypeChoice.TEXT:
         try:
-            results = await icp_query(
-                keyword,
-                SearchType[search_type.name],
-                captcha_max_retry=captcha_max_retry,
-            )
+            results = await run_query()
         except ICPQueryError as e:
-            sys.stderr.write("ICP查询失败")
+            sys.stderr.write("ICP查询超时" if isinstance(e, ICPQueryTimeout) else "ICP查询失败")
             sys.exit(-1)
         else:
             sys.stdout.write(results.to_text())
 
 
+@app.command(help="启动常驻查询HTTP服务")
+async def serve(
+    host: str = Option("127.0.0.1", "--host", help="监听地址"),
+    port: int = Option(8000, "-p", "--port", help="监听端口"),
+    concurrency: int = Option(4, "-c", "--concurrency", help="最大并发查询数"),
+    max_pending: int = Option(64, "--max-pending", help="最大排队查询数"),
+    cache_ttl: float = Option(600.0, "--cache-ttl", help="查询结果缓存时间(秒), 0为不缓存"),
+    captcha_max_retry: int = Option(
+        10,
+        "--max-retry",
+        help="验证码最大重试次数",
+    ),
+    timeout: Optional[float] = Option(
+        None,
+        "--timeout",
+        help="单次查询总耗时预算(秒), 默认不限制",
+        show_default=False,
+    ),
+):
+    from icpquery.server import IcpQueryServer
+
+    server = IcpQueryServer(
+        host=host,
+        port=port,
+        max_concurrency=concurrency,
+        max_pending=max_pending,
+        cache_ttl=cache_ttl,
+        captcha_max_retry=captcha_max_retry,
+        query_timeout=timeout,
+    )
+    console.print(f"ICP查询服务监听于 [green]http://{host}:{port}[/]")
+    await server.serve_forever()
+
+
+@app.command(help="批量查询关键词, 支持断点续查与多进程协作")
+async def sweep(
+    keywords_file: Optional[Path] = Argument(
+        None,
+        help="关键词列表文件(每行一个), 不指定时仅继续已有日志",
+        show_default=False,
+    ),
+    journal_file: Path = Option(Path("sweep.db"), "-j", "--journal", help="断点日志文件"),
+    search_type: SearchTypeChoice = Option(
+        SearchTypeChoice.DOMAIN,
+        "-t",
+        "--type",
+        help="搜索类型",
+    ),
+    concurrency: int = Option(1, "-c", "--concurrency", help="本进程并发数"),
+    max_attempts: int = Option(5, "--max-attempts", help="每个关键词最大尝试次数"),
+    backoff: float = Option(30.0, "--backoff", help="失败退避基础时间(秒)"),
+    captcha_max_retry: int = Option(
+        10,
+        "--max-retry",
+        help="验证码最大重试次数",
+    ),
+    timeout: Optional[float] = Option(
+        None,
+        "--timeout",
+        help="单次查询总耗时预算(秒), 默认不限制",
+        show_default=False,
+    ),
+    export: Optional[Path] = Option(None, "-o", "--export", help="导出已完成结果(JSON Lines)"),
+    rescan: Optional[float] = Option(
+        None,
+        "--rescan",
+        help="重新查询完成时间早于该秒数之前的关键词 (0为全部), 最近有变更的优先",
+        show_default=False,
+    ),
+    rescan_limit: Optional[int] = Option(
+        None, "--rescan-limit", help="最多重新查询的关键词数量", show_default=False
+    ),
+    changes: Optional[Path] = Option(
+        None, "--changes", help="导出记录变更流(JSON Lines, 新增/删除/变更)", show_default=False
+    ),
+    since: int = Option(0, "--since", help="变更流起始序号(不含), 传入上次导出的最后序号以增量导出"),
+):
+    from icpquery.sweep import SweepJournal, export_changes, export_results, query_all_pages, run_sweep
+
+    def on_done(keyword: str, search_type: SearchType, error: BaseException | None):
+        if error is None:
+            console.print(f"[green]完成[/] {keyword}")
+        else:
+            console.print(f"[red]失败[/] {keyword} ({type(error).__name__})")
+
+    with SweepJournal(journal_file) as journal:
+        if keywords_file is not None:
+            with open(keywords_file, encoding="utf-8") as f:
+                keywords = [line.strip() for line in f if line.strip()]
+            if search_type == SearchTypeChoice.ALL:
+                search_types = list(SearchType)
+            else:
+                search_types = [SearchType[search_type.name]]
+            added = sum(journal.add(keywords, t) for t in search_types)
+            console.print(f"新增关键词 {added} 个")
+        if rescan is not None:
+            console.print(f"重新查询关键词 {journal.rescan(rescan, rescan_limit)} 个")
+
+        await run_sweep(
+            journal,
+            partial(query_all_pages, captcha_max_retry=captcha_max_retry, timeout=timeout),
+            concurrency=concurrency,
+            max_attempts=max_attempts,
+            backoff=backoff,
+            callback=on_done,
+        )
+        stats = journal.stats()
+        console.print(", ".join(f"{k}: {v}" for k, v in stats.items()))
+        if export is not None:
+            export_results(journal, export)
+        if changes is not None:
+            last_seq = export_changes(journal, changes, since)
+            console.print(f"变更流已导出至序号 {last_seq}")
+
+
+@app.command(help="测量各推理后端耗时并选择最快的后端")
+def calibrate(
+    repeat: int = Option(20, "-n", "--repeat", help="测量次数"),
+    save: bool = Option(True, "--save/--no-save", help="是否保存最快的后端"),
+    concurrency: int = Option(8, "-c", "--concurrency", help="测量批量推理时的并发识别数"),
+):
+    from icpquery.captcha import calibrate_backends, calibrate_batching
+    from icpquery.inference import CONFIG_PATH
+
+    results = calibrate_backends(repeat=repeat, save=save)
+    table = Table(title="推理后端耗时", title_justify="left")
+    table.add_column("后端")
+    table.add_column("参数")
+    table.add_column("耗时(ms)", justify="right")
+    for name, options, latency in results:
+        table.add_row(name, str(options or ""), "[red]不可用" if latency is None else f"{latency * 1000:.2f}")
+    console.print(table)
+    if any(latency is not None for _, _, latency in results):
+        direct, batched = calibrate_batching(repeat=repeat, concurrency=concurrency, save=save)
+        console.print(
+            f"并发 {concurrency} 个识别: 逐个推理 {direct:.1f} 个/秒, 跨验证码批量推理 {batched:.1f} 个/秒, "
+            f"{'[green]启用' if batched > direct else '[yellow]不启用'}[/]批量推理"
+        )
+        if save:
+            console.print(f"已保存到 [green]{CONFIG_PATH}[/]")
+
+
+@app.command("build-store", help="将底图模板打包为可内存映射的文件, 多进程共享且无需解码")
+def build_store():
+    from icpquery.captcha import BACKGROUND_STORE_PATH, build_background_store
+
+    path = build_background_store(BACKGROUND_STORE_PATH)
+    console.print(f"已保存到 [green]{path}[/] (索引 {path.with_suffix('.json')})")
+    console.print("可通过环境变量 ICPQUERY_BACKGROUND_STORE 指定打包文件路径")
+
+
+@app.command(help="使用当前识别逻辑离线回放验证码样本库")
+def replay(
+    corpus_file: Path = Argument(..., help="验证码样本库文件 (由 ICPQUERY_CAPTCHA_CORPUS 记录)"),
+    outcome: Optional[CaptchaOutcome] = Option(
+        None,
+        "--outcome",
+        help="仅回放该识别结果的样本",
+        show_default=False,
+    ),
+):
+    from icpquery.corpus import CaptchaCorpus, ReplayOutcome
+    from icpquery.corpus import replay as replay_corpus
+
+    with CaptchaCorpus(corpus_file) as corpus:
+        summary = replay_corpus(corpus, outcome)
+    table = Table(title="回放结果", title_justify="left")
+    table.add_column("记录结果")
+    for result in ReplayOutcome:
+        table.add_column(result.value, justify="right")
+    for recorded, counter in summary.items():
+        table.add_row(recorded.value, *(str(counter[result]) for result in ReplayOutcome))
+    console.print(table)
+
+
 if __name__ == "__main__":
     app()
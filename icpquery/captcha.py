@@ -1,15 +1,199 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from functools import cache
 from pathlib import Path
 
 import cv2
 import numpy as np
-from onnxruntime import InferenceSession
 
+from .inference import (
+    BACKENDS,
+    BackendFactory,
+    InferenceBackend,
+    InferenceBatcher,
+    NumpyBackend,
+    OnnxRuntimeBackend,
+    OpenCVBackend,
+    backend_factory,
+    batcher_from_config,
+    save_backend_config,
+    save_batch_config,
+)
+from .learning import BackgroundLearner
+from .profiling import stage
 from .schema import CaptchaModule, CpatchaBackguard, Points
 
 # 模型路径
 MODULES_PATH = Path(__file__).parent / "models"
 # 原始底图路径
 BACKGROUNDS_PATH = Path(__file__).parent / "backgrounds"
+# 底图模板打包文件, 索引为同名 .json 文件 (由 tools/build_background_store.py 生成)
+BACKGROUND_STORE_PATH = Path(
+    os.environ.get("ICPQUERY_BACKGROUND_STORE", Path(__file__).parent / "backgrounds.npy")
+)
+# 在线学习到的底图模板保存目录, 未设置时仅保存在内存中
+LEARNED_BACKGROUNDS_PATH = os.environ.get("ICPQUERY_LEARNED_BACKGROUNDS")
+# 孪生网络完整模型
+SIAMESE_MODEL_FILE = "siamese.onnx"
+# 孪生网络拆分后的编码器与相似度头模型 (由 tools/split_siamese_model.py 生成)
+ENCODER_MODEL_FILE = "siamese_encoder.onnx"
+HEAD_MODEL_FILE = "siamese_head.onnx"
+# 模型输入尺寸
+MODEL_INPUT_SIZE = (105, 105)
+# 前景掩膜膨胀核
+DILATE_KERNEL = np.ones((4, 4), np.uint8)
+
+_thread_local = threading.local()
+
+
+class PreprocessBuffers:
+    """验证码预处理缓冲区
+    每个工作线程按图片尺寸复用一组, 避免每张验证码重复分配中间图片
+    """
+
+    def __init__(self, shape: tuple[int, ...]) -> None:
+        h, w = shape[:2]
+        self.shape = shape
+        self.diff = np.empty((h, w, 3), np.bool_)
+        self.plain_img = np.empty((h, w, 3), np.uint8)
+        self.gray = np.empty((h, w), np.uint8)
+        self.binary = np.empty((h, w), np.uint8)
+        self.fg_mask = np.empty((h, w), np.uint8)
+        self.rgb = np.empty((h, w, 3), np.uint8)
+        self.tensor = np.empty((h, w, 3), np.float32)
+
+
+def get_buffers(name: str, shape: tuple[int, ...]) -> PreprocessBuffers:
+    """获取当前线程的预处理缓冲区
+    Args:
+        name: 缓冲区名
+        shape: 图片尺寸
+    Returns:
+        PreprocessBuffers: 预处理缓冲区
+    """
+    pool: dict[str, PreprocessBuffers] = getattr(_thread_local, "buffers", None)
+    if pool is None:
+        pool = _thread_local.buffers = {}
+    bufs = pool.get(name)
+    if bufs is None or bufs.shape != shape:
+        bufs = pool[name] = PreprocessBuffers(shape)
+    return bufs
+
+
+def build_background_store(path: Path = BACKGROUND_STORE_PATH) -> Path:
+    """将全部底图模板及其灰度图打包为一个连续的 .npy 文件
+    Args:
+        path: 打包文件路径, 索引保存为同名 .json 文件
+    Returns:
+        Path: 打包文件路径
+    """
+    index = {}
+    imgs = []
+    offset = 0
+    for tag in CpatchaBackguard:
+        png = (BACKGROUNDS_PATH / f"{tag.value}.png").read_bytes()
+        bg_img = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+        # 记录PNG摘要, 底图修改后打包文件中的模板即失效
+        entry = {"sha256": hashlib.sha256(png).hexdigest()}
+        for kind, img in (("bgr", bg_img), ("gray", cv2.cvtColor(bg_img, cv2.COLOR_BGR2GRAY))):
+            entry[kind] = {"offset": offset, "shape": list(img.shape)}
+            imgs.append((offset, img))
+            # 按64字节对齐
+            offset += -(-img.size // 64) * 64
+        index[tag.value] = entry
+
+    blob = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(offset,))
+    for img_offset, img in imgs:
+        blob[img_offset : img_offset + img.size] = img.ravel()
+    blob.flush()
+    del blob
+    path.with_suffix(".json").write_text(json.dumps(index), encoding="utf-8")
+    return path
+
+
+@cache
+def open_background_store() -> dict[str, dict[str, np.ndarray]] | None:
+    """只读内存映射底图模板打包文件, 多个进程共享同一份页缓存且无需解码
+    与PNG摘要不一致的模板视为过期并跳过, 由调用方回退到解码PNG
+    Returns:
+        dict | None: {底图名: {"bgr": 彩色图, "gray": 灰度图}}, 打包文件不存在时为None
+    """
+    index_file = BACKGROUND_STORE_PATH.with_suffix(".json")
+    if not (BACKGROUND_STORE_PATH.exists() and index_file.exists()):
+        return None
+    blob = np.load(BACKGROUND_STORE_PATH, mmap_mode="r")
+    index = json.loads(index_file.read_text(encoding="utf-8"))
+    store = {}
+    stale = []
+    for name, entry in index.items():
+        bg_file = BACKGROUNDS_PATH / f"{name}.png"
+        digest = hashlib.sha256(bg_file.read_bytes()).hexdigest() if bg_file.exists() else None
+        if digest is None or entry.pop("sha256", None) != digest:
+            stale.append(name)
+            continue
+        store[name] = {
+            kind: blob[e["offset"] : e["offset"] + math.prod(e["shape"])].reshape(e["shape"])
+            for kind, e in entry.items()
+        }
+    if stale:
+        warnings.warn(
+            f"background store {BACKGROUND_STORE_PATH} is stale for {', '.join(stale)}, "
+            "decoding PNG instead; rebuild it with tools/build_background_store.py",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+    return store
+
+
+@cache
+def get_background_learner() -> BackgroundLearner:
+    "获取进程内共享的未知底图学习器"
+    return BackgroundLearner(None if LEARNED_BACKGROUNDS_PATH is None else Path(LEARNED_BACKGROUNDS_PATH))
+
+
+@cache
+def load_bg_img(bg_type: CpatchaBackguard | str) -> np.ndarray:
+    """加载原始底图 (优先使用打包文件, 否则解码PNG并进程内缓存, 只读)
+    Args:
+        bg_type: 背景类型, 字符串为在线学习到的底图模板名
+    Returns:
+        ndarray: 底图
+    """
+    if isinstance(bg_type, str):
+        return get_background_learner().template(bg_type)[0]
+    store = open_background_store()
+    if store is not None and bg_type.value in store:
+        return store[bg_type.value]["bgr"]
+    bg_file = BACKGROUNDS_PATH / f"{bg_type.value}.png"
+    bg_img = cv2.imread(str(bg_file), cv2.IMREAD_COLOR)
+    bg_img.flags.writeable = False
+    return bg_img
+
+
+@cache
+def load_bg_gray(bg_type: CpatchaBackguard | str) -> np.ndarray:
+    """加载原始底图灰度图 (只读)
+    Args:
+        bg_type: 背景类型, 字符串为在线学习到的底图模板名
+    Returns:
+        ndarray: 底图灰度图
+    """
+    if isinstance(bg_type, str):
+        return get_background_learner().template(bg_type)[1]
+    store = open_background_store()
+    if store is not None and bg_type.value in store:
+        return store[bg_type.value]["gray"]
+    bg_gray = cv2.cvtColor(load_bg_img(bg_type), cv2.COLOR_BGR2GRAY)
+    bg_gray.flags.writeable = False
+    return bg_gray
 
 
 def images_sim(img_a: np.ndarray, img_b: np.ndarray) -> float:
@@ -22,6 +206,17 @@ def images_sim(img_a: np.ndarray, img_b: np.ndarray) -> float:
     """
     img_a_gray = cv2.cvtColor(img_a, cv2.COLOR_BGR2GRAY)
     img_b_gray = cv2.cvtColor(img_b, cv2.COLOR_BGR2GRAY)
+    return gray_images_sim(img_a_gray, img_b_gray)
+
+
+def gray_images_sim(img_a_gray: np.ndarray, img_b_gray: np.ndarray) -> float:
+    """计算灰度图片相似度 使用均方误差(MSE)算法
+    Args:
+        img_a_gray: 灰度图片A
+        img_b_gray: 灰度图片B
+    Returns:
+        float: 相似度评分(越小越相似)
+    """
     h, w = img_a_gray.shape
     diff = cv2.subtract(img_a_gray, img_b_gray)
     err = np.sum(diff**2)
@@ -29,30 +224,30 @@ def images_sim(img_a: np.ndarray, img_b: np.ndarray) -> float:
     return mse
 
 
-def detect_bg_type(neddle_img: np.ndarray, threshold: float = 1.8) -> CpatchaBackguard | None:
-    """识别底图背景类型
+def detect_bg_type(neddle_img: np.ndarray, threshold: float = 1.8) -> CpatchaBackguard | str | None:
+    """识别底图背景类型, 内置底图均不匹配时在在线学习到的底图模板中识别
     Args:
         neddle_img: 欲识别的图片
         threshold: 识别阈值
     Returns:
-        CpatchaBackguard: 背景图类型
+        CpatchaBackguard | str: 背景图类型, 字符串为在线学习到的底图模板名
     """
+    neddle_gray = cv2.cvtColor(neddle_img, cv2.COLOR_BGR2GRAY)
     for tag in CpatchaBackguard._member_map_.values():
-        hay_file = BACKGROUNDS_PATH / f"{tag.value}.png"
-        hay_img = cv2.imread(str(hay_file), cv2.IMREAD_COLOR)
+        hay_gray = load_bg_gray(tag)
 
         # 图片尺寸不一致, 直接判定为不相似, 无需比对
-        if hay_img.shape != neddle_img.shape:
+        if hay_gray.shape != neddle_gray.shape:
             continue
 
-        mse = images_sim(hay_img, neddle_img)
+        mse = gray_images_sim(hay_gray, neddle_gray)
         if mse <= threshold:
             return tag
     else:
-        return None
+        return get_background_learner().match(neddle_gray)
 
 
-def remove_bg(orig_img: np.ndarray, bg_type: CpatchaBackguard) -> np.ndarray:
+def remove_bg(orig_img: np.ndarray, bg_type: CpatchaBackguard | str) -> np.ndarray:
     """去除底图背景
     Args:
         orig_img: 原始图片
@@ -60,8 +255,7 @@ def remove_bg(orig_img: np.ndarray, bg_type: CpatchaBackguard) -> np.ndarray:
     Returns:
         ndarray: 去除背景后的图片
     """
-    bg_file = BACKGROUNDS_PATH / f"{bg_type.value}.png"
-    bg_img = cv2.imread(str(bg_file), cv2.IMREAD_COLOR)
+    bg_img = load_bg_img(bg_type)
     new_bg_img = np.zeros_like(orig_img)
 
     mask = bg_img != orig_img
@@ -80,13 +274,81 @@ def detect_obj(bg_img: np.ndarray) -> list[cv2.typing.Rect]:
     bg_img_gray = cv2.cvtColor(bg_img, cv2.COLOR_BGR2GRAY)
     _, bg_img_binary = cv2.threshold(bg_img_gray, 20, 255, cv2.THRESH_BINARY)
 
-    bg_img_binary = cv2.dilate(bg_img_binary, np.ones((4, 4), np.uint8))
-    contours, _ = cv2.findContours(bg_img_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    bg_img_binary = cv2.dilate(bg_img_binary, DILATE_KERNEL)
+    return find_roi_boxes(bg_img_binary)
+
+
+def find_roi_boxes(fg_mask: np.ndarray) -> list[cv2.typing.Rect]:
+    """根据前景掩膜计算文字轮廓外接矩形
+    Args:
+        fg_mask: 二值化前景掩膜
+    Returns:
+        list[tuple]: 对象区域集 (x, y, w, h)
+    """
+    contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     boxes = [cv2.boundingRect(contour) for contour in contours]
 
     return boxes
 
 
+def normalize_rgb(img: np.ndarray, bufs: PreprocessBuffers) -> np.ndarray:
+    """BGR图片转换为归一化RGB浮点张量 (写入缓冲区)
+    Args:
+        img: BGR图片
+        bufs: 预处理缓冲区
+    Returns:
+        ndarray: 归一化RGB张量 (H, W, 3)
+    """
+    cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=bufs.rgb)
+    np.divide(bufs.rgb, np.float32(255.0), out=bufs.tensor)
+    return bufs.tensor
+
+
+def preprocess_bg(orig_img: np.ndarray, bg_img: np.ndarray) -> PreprocessBuffers:
+    """融合预处理底图: 一次性计算去背景图片、前景掩膜与归一化RGB张量
+    Args:
+        orig_img: 原始图片
+        bg_img: 背景图片
+    Returns:
+        PreprocessBuffers: 预处理结果 (当前线程的复用缓冲区)
+    """
+    bufs = get_buffers("bg", orig_img.shape)
+
+    # 去除背景
+    np.not_equal(bg_img, orig_img, out=bufs.diff)
+    np.multiply(orig_img, bufs.diff, out=bufs.plain_img)
+
+    # 前景掩膜
+    cv2.cvtColor(bufs.plain_img, cv2.COLOR_BGR2GRAY, dst=bufs.gray)
+    cv2.threshold(bufs.gray, 20, 255, cv2.THRESH_BINARY, dst=bufs.binary)
+    cv2.dilate(bufs.binary, DILATE_KERNEL, dst=bufs.fg_mask)
+
+    normalize_rgb(bufs.plain_img, bufs)
+    return bufs
+
+
+def preprocess_ptr(ptr_img: np.ndarray) -> np.ndarray:
+    """预处理点选文字图片
+    Args:
+        ptr_img: 原始文字图片
+    Returns:
+        ndarray: 归一化RGB张量 (当前线程的复用缓冲区)
+    """
+    bufs = get_buffers("ptr", ptr_img.shape)
+    return normalize_rgb(ptr_img, bufs)
+
+
+def to_model_input(img_part: np.ndarray) -> np.ndarray:
+    """归一化RGB图片块转换为模型输入
+    Args:
+        img_part: 归一化RGB图片块 (可为缓冲区视图)
+    Returns:
+        ndarray: 模型输入 (1, 3, 105, 105)
+    """
+    img_part = cv2.resize(img_part, MODEL_INPUT_SIZE)
+    return np.ascontiguousarray(img_part.transpose(2, 0, 1)[np.newaxis])
+
+
 def spilt_pointer_img(pointer_img: np.ndarray) -> list[np.ndarray]:
     """裁剪点选文字图片
     Args:
@@ -99,62 +361,469 @@ def spilt_pointer_img(pointer_img: np.ndarray) -> list[np.ndarray]:
     return imgs
 
 
+class EmbeddingCache:
+    """文字图片特征向量LRU缓存
+    以预处理后模型输入的哈希为键, 线程安全
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @staticmethod
+    def make_key(model_input: np.ndarray) -> bytes:
+        return hashlib.blake2b(model_input.tobytes(), digest_size=16).digest()
+
+    def get(self, key: bytes) -> np.ndarray | None:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: bytes, value: np.ndarray):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class SiameseModel:
+    """孪生网络文字相似度模型
+    存在拆分后的编码器与相似度头模型时, 每个图片块只编码一次, 文字图片特征向量跨验证码缓存;
+    否则回退到完整模型逐对推理; 指定批量推理器时, 并发识别的推理请求合并为批量执行
+    """
+
+    def __init__(
+        self,
+        models_path: Path = MODULES_PATH,
+        cache_size: int = 1024,
+        backend: BackendFactory | None = None,
+        batcher: InferenceBatcher | None = None,
+    ) -> None:
+        with stage("load_model"):
+            self._load(models_path, backend or backend_factory())
+        self.cache = EmbeddingCache(cache_size)
+        self.batcher = batcher
+
+    def _load(self, models_path: Path, backend: BackendFactory):
+        encoder_file = models_path / ENCODER_MODEL_FILE
+        head_file = models_path / HEAD_MODEL_FILE
+        if encoder_file.exists() and head_file.exists():
+            self.encoder = backend(encoder_file)
+            self.head = backend(head_file)
+            self.session = None
+        else:
+            self.encoder = self.head = None
+            self.session = backend(models_path / SIAMESE_MODEL_FILE)
+
+    @property
+    def is_split(self) -> bool:
+        return self.session is None
+
+    def encode(self, model_input: np.ndarray) -> np.ndarray:
+        """图片块编码为特征向量
+        Args:
+            model_input: 模型输入 (1, 3, 105, 105)
+        Returns:
+            ndarray: 特征向量
+        """
+        return self.encoder.run({"input": model_input})[0]
+
+    def encode_cached(self, model_input: np.ndarray) -> np.ndarray:
+        """图片块编码为特征向量 (使用LRU缓存)"""
+        key = self.cache.make_key(model_input)
+        embedding = self.cache.get(key)
+        if embedding is None:
+            embedding = self.encode(model_input)
+            self.cache.put(key, embedding)
+        return embedding
+
+    def _run_many(self, backend: InferenceBackend, feeds: list[dict[str, np.ndarray]]) -> list[np.ndarray]:
+        "执行一组推理, 返回每项的第一个模型输出"
+        if self.batcher is not None:
+            return self.batcher.run_many(backend, feeds)
+        return [backend.run(feed)[0] for feed in feeds]
+
+    def score_matrix(
+        self,
+        haystack_inputs: list[np.ndarray],
+        needle_inputs: list[np.ndarray],
+        mask: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """计算文字图片与底图ROI区域两两相似度
+        Args:
+            haystack_inputs: 底图ROI区域模型输入列表
+            needle_inputs: 文字图片模型输入列表
+            mask: 需要计算的组合 (文字数, ROI区域数), 为None时全部计算
+        Returns:
+            ndarray: 相似度矩阵 (文字数, ROI区域数), 取值0~1, 未计算的组合为NaN
+        """
+        if mask is None:
+            mask = np.ones((len(needle_inputs), len(haystack_inputs)), np.bool_)
+        logits = np.full(mask.shape, np.nan, np.float32)
+        pairs = list(zip(*np.nonzero(mask)))
+        with self.batcher.session() if self.batcher is not None else nullcontext():
+            if self.is_split:
+                haystack_idx = [j for j in range(len(haystack_inputs)) if mask[:, j].any()]
+                needle_keys = {
+                    i: self.cache.make_key(needle_inputs[i])
+                    for i in range(len(needle_inputs))
+                    if mask[i].any()
+                }
+                needle_embs = {i: self.cache.get(key) for i, key in needle_keys.items()}
+                missing = [i for i, emb in needle_embs.items() if emb is None]
+                # 底图ROI区域与未缓存的文字图片一起编码
+                embs = self._run_many(
+                    self.encoder,
+                    [{"input": haystack_inputs[j]} for j in haystack_idx]
+                    + [{"input": needle_inputs[i]} for i in missing],
+                )
+                haystack_embs = dict(zip(haystack_idx, embs))
+                for i, emb in zip(missing, embs[len(haystack_idx) :]):
+                    needle_embs[i] = emb
+                    self.cache.put(needle_keys[i], emb)
+                outputs = self._run_many(
+                    self.head,
+                    [{"embedding_a": haystack_embs[j], "embedding_b": needle_embs[i]} for i, j in pairs],
+                )
+            else:
+                outputs = self._run_many(
+                    self.session,
+                    [{"input": haystack_inputs[j], "input.53": needle_inputs[i]} for i, j in pairs],
+                )
+        for (i, j), output in zip(pairs, outputs):
+            logits[i, j] = output[0][0]
+        return 1 / (1 + np.exp(-logits))
+
+
+@cache
+def get_siamese_model() -> SiameseModel:
+    "获取进程内共享的孪生网络模型"
+    return SiameseModel(batcher=batcher_from_config())
+
+
+def calibrate_backends(
+    models_path: Path = MODULES_PATH,
+    repeat: int = 20,
+    save: bool = True,
+) -> list[tuple[str, dict, float | None]]:
+    """测量各推理后端在本机单核完成一张验证码推理的耗时, 并保存最快的后端
+    Args:
+        models_path: 模型目录
+        repeat: 测量次数
+        save: 是否保存最快的后端
+    Returns:
+        list[tuple]: (后端名, 后端参数, 平均耗时秒), 不可用或结果不一致的后端耗时为None
+    """
+    # 均限制为单线程, 比较单核性能
+    candidates = [
+        (OnnxRuntimeBackend.name, {"threads": 1}),
+        (OpenCVBackend.name, {"threads": 1}),
+        (NumpyBackend.name, {}),
+    ]
+    rng = np.random.default_rng(0)
+    haystack_inputs = [rng.random((1, 3, *MODEL_INPUT_SIZE), np.float32) for _ in range(6)]
+    needle_inputs = [rng.random((1, 3, *MODEL_INPUT_SIZE), np.float32) for _ in range(4)]
+
+    results = []
+    reference = None
+    for name, options in candidates:
+        try:
+            # 不使用特征向量缓存, 模拟未命中缓存的最坏情况
+            model = SiameseModel(models_path, cache_size=0, backend=backend_factory(name, options))
+            scores = model.score_matrix(haystack_inputs, needle_inputs)
+            if reference is None:
+                reference = scores
+            elif not np.allclose(scores, reference, atol=1e-3):
+                raise ValueError("inference result mismatch")
+            start = time.perf_counter()
+            for _ in range(repeat):
+                model.score_matrix(haystack_inputs, needle_inputs)
+            results.append((name, options, (time.perf_counter() - start) / repeat))
+        except Exception:
+            results.append((name, options, None))
+
+    timed = [r for r in results if r[2] is not None]
+    if save and timed:
+        name, options, _ = min(timed, key=lambda r: r[2])
+        save_backend_config(name, options)
+    return results
+
+
+def calibrate_batching(
+    models_path: Path = MODULES_PATH,
+    repeat: int = 20,
+    concurrency: int = 8,
+    save: bool = True,
+) -> tuple[float, float]:
+    """使用已选择的推理后端, 测量并发识别时逐个推理与跨验证码批量推理的吞吐量, 并保存较快的方式
+    Args:
+        models_path: 模型目录
+        repeat: 每个线程的测量次数
+        concurrency: 并发识别数
+        save: 是否保存
+    Returns:
+        tuple: (逐个推理吞吐量, 批量推理吞吐量), 单位为验证码/秒
+    """
+    rng = np.random.default_rng(0)
+    haystack_inputs = [rng.random((1, 3, *MODEL_INPUT_SIZE), np.float32) for _ in range(6)]
+    needle_inputs = [rng.random((1, 3, *MODEL_INPUT_SIZE), np.float32) for _ in range(4)]
+
+    throughputs = []
+    for batcher in (None, InferenceBatcher()):
+        model = SiameseModel(models_path, cache_size=0, batcher=batcher)
+        model.score_matrix(haystack_inputs, needle_inputs)
+
+        def work():
+            for _ in range(repeat):
+                model.score_matrix(haystack_inputs, needle_inputs)
+
+        threads = [threading.Thread(target=work) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        throughputs.append(concurrency * repeat / (time.perf_counter() - start))
+
+    direct, batched = throughputs
+    if save:
+        save_batch_config(batched > direct)
+    return direct, batched
+
+
+def warmup():
+    "预加载全部底图与孪生网络模型, 供常驻进程启动时调用"
+    for tag in CpatchaBackguard:
+        load_bg_img(tag)
+        load_bg_gray(tag)
+    get_siamese_model()
+
+
+def roi_crop_box(roi_box: cv2.typing.Rect, hs_h: int, hs_w: int) -> cv2.typing.Rect:
+    """ROI区域外扩裁剪框
+    Args:
+        roi_box: ROI区域
+        hs_h: 底图高度
+        hs_w: 底图宽度
+    Returns:
+        tuple: 裁剪框 (x, y, w, h)
+    """
+    x, y, w, h = roi_box
+    if x - 2 >= 0:
+        x -= 2
+    if y - 2 >= 0:
+        x -= 2
+    if h + 2 <= hs_h:
+        h += 2
+    if w + 2 <= hs_w:
+        w += 2
+    return x, y, w, h
+
+
+@dataclass
+class TemplateMatchConfig:
+    """模板匹配快速路径阈值
+    文字图片与各ROI区域的二值字形归一化互相关得分中, 最高分不低于 accept 且领先第二名不少于 margin 时
+    直接采用该区域, 不再调用孪生网络; 否则该文字与全部ROI区域仍由孪生网络计算
+    阈值可使用 tools/bench_template_match.py 评估
+    """
+
+    accept: float = 0.85
+    margin: float = 0.25
+    # 匹配前字形统一缩放尺寸
+    size: int = 32
+
+
+def template_match_from_env() -> TemplateMatchConfig | None:
+    """读取环境变量 ICPQUERY_TEMPLATE_MATCH: 1 使用默认阈值, "accept,margin" 指定阈值, 未设置或0为禁用
+    Returns:
+        TemplateMatchConfig | None: 模板匹配阈值, 禁用时为None
+    """
+    env = os.environ.get("ICPQUERY_TEMPLATE_MATCH", "").strip().lower()
+    if env in ("", "0", "false", "no"):
+        return None
+    if env in ("1", "true", "yes"):
+        return TemplateMatchConfig()
+    accept, margin = (float(v) for v in env.split(","))
+    return TemplateMatchConfig(accept=accept, margin=margin)
+
+
+# 默认模板匹配阈值, 为None时禁用快速路径, 识别时读取, 可在运行时修改
+# 阈值尚未在线上验证码上评估, 默认禁用
+TEMPLATE_MATCH: TemplateMatchConfig | None = template_match_from_env()
+
+
+def binarize_glyph(img_part: np.ndarray, size: int) -> np.ndarray:
+    """归一化RGB图片块二值化为定尺寸字形图 (前景为文字)
+    Args:
+        img_part: 归一化RGB图片块
+        size: 输出尺寸
+    Returns:
+        ndarray: 字形图 (size, size) float32
+    """
+    gray = cv2.cvtColor(img_part, cv2.COLOR_RGB2GRAY)
+    gray = cv2.convertScaleAbs(gray, alpha=255.0)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # 文字笔画占少数像素
+    if cv2.countNonZero(binary) > binary.size / 2:
+        binary = cv2.bitwise_not(binary)
+    # 裁剪到文字外接矩形, 消除留白与位置差异
+    x, y, w, h = cv2.boundingRect(binary)
+    if w and h:
+        binary = binary[y : y + h, x : x + w]
+    return cv2.resize(binary, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def template_score_matrix(haystack_glyphs: list[np.ndarray], needle_glyphs: list[np.ndarray]) -> np.ndarray:
+    """计算文字图片与底图ROI区域字形两两归一化互相关得分
+    Args:
+        haystack_glyphs: 底图ROI区域字形图列表
+        needle_glyphs: 文字字形图列表
+    Returns:
+        ndarray: 得分矩阵 (文字数, ROI区域数), 取值-1~1
+    """
+    scores = np.zeros((len(needle_glyphs), len(haystack_glyphs)), np.float32)
+    for i, needle_glyph in enumerate(needle_glyphs):
+        for j, haystack_glyph in enumerate(haystack_glyphs):
+            scores[i, j] = cv2.matchTemplate(haystack_glyph, needle_glyph, cv2.TM_CCOEFF_NORMED)[0, 0]
+    # 纯色字形无法计算相关系数
+    return np.nan_to_num(scores, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def template_match_decide(
+    tm_scores: np.ndarray, config: TemplateMatchConfig
+) -> tuple[dict[int, int], np.ndarray]:
+    """根据模板匹配得分分级
+    Args:
+        tm_scores: 模板匹配得分矩阵
+        config: 模板匹配阈值
+    Returns:
+        tuple: ({文字序号: 直接采用的ROI区域序号}, 需要孪生网络计算的组合掩膜)
+    """
+    decided = {}
+    mask = np.zeros(tm_scores.shape, np.bool_)
+    for i, row in enumerate(tm_scores):
+        order = np.argsort(row)[::-1]
+        best = row[order[0]]
+        second = row[order[1]] if len(order) > 1 else -1.0
+        if best >= config.accept and best - second >= config.margin:
+            decided[i] = int(order[0])
+        else:
+            mask[i] = True
+    return decided, mask
+
+
+@dataclass
+class SolveTrace:
+    """验证码识别中间结果, 用于记录识别失败样本"""
+
+    bg_type: str | None = None
+    roi_boxes: list[cv2.typing.Rect] = field(default_factory=list)
+    # 模板匹配得分矩阵 (文字数, ROI区域数)
+    template_scores: np.ndarray | None = None
+    # 孪生网络相似度矩阵 (文字数, ROI区域数), 未计算的组合为NaN
+    scores: np.ndarray | None = None
+    points: list[tuple] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        def matrix(m: np.ndarray | None) -> list | None:
+            if m is None:
+                return None
+            return [[None if math.isnan(v) else round(float(v), 4) for v in row] for row in m]
+
+        return {
+            "bg_type": self.bg_type,
+            "roi_boxes": [list(box) for box in self.roi_boxes],
+            "template_scores": matrix(self.template_scores),
+            "scores": matrix(self.scores),
+            "points": [list(point) for point in self.points],
+        }
+
+
 def detect_answer_pos(
     haystack_img: np.ndarray,
     needle_img_lst: list[np.ndarray],
     roi_boxes: list[cv2.typing.Rect],
     threshold: float = 0.6,
+    template_match: TemplateMatchConfig | None = None,
+    trace: SolveTrace | None = None,
 ) -> list[tuple]:
     """根据相似度识别文字点选顺序
+    先用模板匹配对候选分级, 只对无法直接判定的组合调用孪生网络
     Args:
-        haystack_img: 底图
-        needle_img_lst: 文字图片列表
+        haystack_img: 底图归一化RGB张量
+        needle_img_lst: 文字图片归一化RGB张量列表
         boxes: 底图ROI区域列表
         threshold: 识别阈值
+        template_match: 模板匹配阈值, 为None时使用 TEMPLATE_MATCH, 二者均为None时全部使用孪生网络
+        trace: 记录得分矩阵
     Returns:
         list[tuple]: 符合顺序要求的坐标集列表
     """
+    template_match = template_match or TEMPLATE_MATCH
+    if not roi_boxes:
+        return []
     hs_h, hs_w, _ = haystack_img.shape
-    session = InferenceSession(MODULES_PATH / "siamese.onnx")
-    result_lst = []
 
-    for needle_img_part in needle_img_lst:
-        needle_img_part = cv2.cvtColor(needle_img_part, cv2.COLOR_BGR2RGB)
-        needle_img_part = cv2.resize(needle_img_part, (105, 105))
-        needle_img_part = needle_img_part / 255.0
-        needle_img_part = np.transpose(needle_img_part, (2, 0, 1))
-        needle_img_part = np.expand_dims(needle_img_part, axis=0).astype(np.float32)
-        for roi_box in roi_boxes:
-            x, y, w, h = roi_box
-            if x - 2 >= 0:
-                x -= 2
-            if y - 2 >= 0:
-                x -= 2
-            if h + 2 <= hs_h:
-                h += 2
-            if w + 2 <= hs_w:
-                w += 2
-            haystack_img_part = haystack_img[y : y + h, x : x + w]
-            haystack_img_part = cv2.cvtColor(haystack_img_part, cv2.COLOR_BGR2RGB)
-            haystack_img_part = cv2.resize(haystack_img_part, (105, 105))
-            haystack_img_part = haystack_img_part / 255.0
-            haystack_img_part = np.transpose(haystack_img_part, (2, 0, 1))
-            haystack_img_part = np.expand_dims(haystack_img_part, axis=0).astype(np.float32)
-
-            inputs = {
-                "input": haystack_img_part,
-                "input.53": needle_img_part,
-            }
-            output = session.run(None, inputs)
-            output_sigmoid = 1 / (1 + np.exp(-output[0]))
-            res = output_sigmoid[0][0]
+    # 每个ROI区域只裁剪一次 (缓冲区视图)
+    haystack_parts = []
+    centers = []
+    for roi_box in roi_boxes:
+        x, y, w, h = roi_crop_box(roi_box, hs_h, hs_w)
+        haystack_parts.append(haystack_img[y : y + h, x : x + w])
+        centers.append(
+            (
+                round(x + w / 2),  # X
+                round(y + h / 2),  # Y
+            )
+        )
+
+    if template_match is None:
+        decided = {}
+        mask = np.ones((len(needle_img_lst), len(haystack_parts)), np.bool_)
+    else:
+        with stage("template_match"):
+            tm_scores = template_score_matrix(
+                [binarize_glyph(part, template_match.size) for part in haystack_parts],
+                [binarize_glyph(part, template_match.size) for part in needle_img_lst],
+            )
+            decided, mask = template_match_decide(tm_scores, template_match)
+        if trace is not None:
+            trace.template_scores = tm_scores
+
+    scores = np.full(mask.shape, np.nan, np.float32)
+    if mask.any():
+        with stage("inference"):
+            haystack_inputs = [
+                to_model_input(part) if mask[:, j].any() else None for j, part in enumerate(haystack_parts)
+            ]
+            needle_inputs = [
+                to_model_input(part) if mask[i].any() else None for i, part in enumerate(needle_img_lst)
+            ]
+            scores = get_siamese_model().score_matrix(haystack_inputs, needle_inputs, mask)
+    if trace is not None:
+        trace.scores = scores
+
+    result_lst = []
+    for i, needle_scores in enumerate(scores):
+        if i in decided:
+            result_lst.append(centers[decided[i]])
+            continue
+        for res, center in zip(needle_scores, centers):
             if res > threshold:
-                result_lst.append(
-                    (
-                        round(x + w / 2),  # X
-                        round(y + h / 2),  # Y
-                    )
-                )
+                result_lst.append(center)
     return result_lst
 
 
@@ -207,29 +876,60 @@ def debug_answer_points(
     cv2.imshow("answer_points", show_img)
 
 
-def fuck_captcha(captcha: CaptchaModule) -> Points | None:
-    "识别验证码点选位置"
-    orig_bg_img = cv2.imdecode(np.frombuffer(captcha.bg_img_data, np.uint8), cv2.IMREAD_COLOR)
-    orig_ptr_img = cv2.imdecode(np.frombuffer(captcha.ptr_img_data, np.uint8), cv2.IMREAD_COLOR)
-
-    # 切分点选文字图片
-    pointer_img_lst = spilt_pointer_img(orig_ptr_img)
+def fuck_captcha(
+    captcha: CaptchaModule,
+    trace: SolveTrace | None = None,
+    learn: bool = True,
+    template_match: TemplateMatchConfig | None = None,
+) -> Points | None:
+    """识别验证码点选位置
+    Args:
+        captcha: 验证码数据
+        trace: 记录识别中间结果
+        learn: 是否将未知底图交给学习器学习, 为False时不改变学习器状态
+        template_match: 模板匹配阈值, 为None时使用 TEMPLATE_MATCH
+    Returns:
+        Points | None: 点选坐标集, 识别失败时为None
+    """
+    with stage("decode_captcha"):
+        orig_bg_img = cv2.imdecode(np.frombuffer(captcha.bg_img_data, np.uint8), cv2.IMREAD_COLOR)
+        orig_ptr_img = cv2.imdecode(np.frombuffer(captcha.ptr_img_data, np.uint8), cv2.IMREAD_COLOR)
 
-    # 识别并去除底图背景
-    bg_type = detect_bg_type(orig_bg_img)
+    # 识别底图背景
+    with stage("detect_bg_type"):
+        bg_type = detect_bg_type(orig_bg_img)
     if bg_type is None:
-        return None
-
-    plain_bg_img = remove_bg(orig_bg_img, bg_type)
-
-    # 识别底图对象
-    roi_boxes = detect_obj(plain_bg_img)
+        if not learn:
+            return None
+        # 记录未知底图, 样本足够时学习出模板并立即使用
+        with stage("learn_background"):
+            bg_type = get_background_learner().observe(orig_bg_img)
+        if bg_type is None:
+            return None
+    if trace is not None:
+        trace.bg_type = bg_type if isinstance(bg_type, str) else bg_type.value
+
+    with stage("preprocess"):
+        # 去除底图背景并计算前景掩膜与模型输入张量
+        bg_bufs = preprocess_bg(orig_bg_img, load_bg_img(bg_type))
+
+        # 切分点选文字图片 (均为缓冲区视图)
+        pointer_img_lst = spilt_pointer_img(preprocess_ptr(orig_ptr_img))
+
+        # 识别底图对象
+        roi_boxes = find_roi_boxes(bg_bufs.fg_mask)
 
     # 识别相似对象坐标
-    answer_points = detect_answer_pos(plain_bg_img, pointer_img_lst, roi_boxes)
+    with stage("detect_answer_pos"):
+        answer_points = detect_answer_pos(
+            bg_bufs.tensor, pointer_img_lst, roi_boxes, template_match=template_match, trace=trace
+        )
+    if trace is not None:
+        trace.roi_boxes = roi_boxes
+        trace.points = answer_points
 
     # DEBUG
-    # debug_background_remover(orig_bg_img, plain_bg_img)
+    # debug_background_remover(orig_bg_img, bg_bufs.plain_img)
     # debug_answer_points(orig_bg_img, orig_ptr_img, roi_boxes, answer_points)
     # cv2.waitKey()
 
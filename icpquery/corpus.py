@@ -0,0 +1,206 @@
+import base64
+import json
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from enum import StrEnum
+from functools import cache
+from pathlib import Path
+from typing import Iterator
+
+from .captcha import SolveTrace, fuck_captcha
+from .schema import CaptchaModule
+
+# 验证码样本库路径, 设置后 resolve_captcha 自动记录样本
+CORPUS_PATH = os.environ.get("ICPQUERY_CAPTCHA_CORPUS")
+
+
+class CaptchaOutcome(StrEnum):
+    """验证码识别结果"""
+
+    UNSOLVED = "unsolved"  # 识别失败
+    REJECTED = "rejected"  # 校验未通过
+    PASSED = "passed"  # 校验通过
+
+
+class ReplayOutcome(StrEnum):
+    """回放结果 (离线无法校验, 与记录的答案比较)"""
+
+    UNSOLVED = "unsolved"  # 识别失败
+    SAME = "same"  # 与记录的答案一致
+    DIFFERENT = "different"  # 与记录的答案不同 (或原先识别失败)
+
+
+class CaptchaCorpus:
+    """验证码样本库
+    基于sqlite, 记录识别失败、校验未通过与按比例抽样的校验通过样本及其识别中间结果;
+    总大小超出上限时优先淘汰最早的校验通过样本, 可用 replay 离线评估识别改动
+    """
+
+    def __init__(
+        self, path: str | Path, max_bytes: int = 256 << 20, passed_sample_rate: float = 0.05
+    ) -> None:
+        """
+        Args:
+            path: 样本库文件路径
+            max_bytes: 样本总大小上限(字节)
+            passed_sample_rate: 校验通过样本的记录比例
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.passed_sample_rate = passed_sample_rate
+        self.conn = sqlite3.connect(self.path, timeout=60.0, isolation_level=None, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS samples (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                outcome TEXT NOT NULL,
+                bg_img BLOB NOT NULL,
+                ptr_img BLOB NOT NULL,
+                word_count INTEGER NOT NULL,
+                trace TEXT,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def record(
+        self, captcha: CaptchaModule, outcome: CaptchaOutcome, trace: SolveTrace | None = None
+    ) -> bool:
+        """记录一个验证码样本, 校验通过的样本按比例抽样
+        Args:
+            captcha: 验证码数据
+            outcome: 识别结果
+            trace: 识别中间结果
+        Returns:
+            bool: 是否已记录
+        """
+        if outcome == CaptchaOutcome.PASSED and random.random() >= self.passed_sample_rate:
+            return False
+        bg_img, ptr_img = captcha.bg_img_data, captcha.ptr_img_data
+        trace_json = None if trace is None else json.dumps(trace.to_dict(), separators=(",", ":"))
+        size = len(bg_img) + len(ptr_img) + len(trace_json or "")
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    """
+                    INSERT INTO samples (outcome, bg_img, ptr_img, word_count, trace, size, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (outcome.value, bg_img, ptr_img, captcha.word_count, trace_json, size, time.time()),
+                )
+                self._evict()
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def _evict(self):
+        (total,) = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM samples").fetchone()
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        evict = []
+        for sample_id, size in self.conn.execute(
+            "SELECT id, size FROM samples ORDER BY outcome = 'passed' DESC, id"
+        ).fetchall():
+            evict.append((sample_id,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.conn.executemany("DELETE FROM samples WHERE id = ?", evict)
+
+    def stats(self) -> dict[str, int]:
+        "各识别结果样本数"
+        counts = {outcome.value: 0 for outcome in CaptchaOutcome}
+        counts.update(self.conn.execute("SELECT outcome, COUNT(*) FROM samples GROUP BY outcome").fetchall())
+        return counts
+
+    def iter_samples(
+        self, outcome: CaptchaOutcome | None = None
+    ) -> Iterator[tuple[int, CaptchaModule, CaptchaOutcome, dict | None]]:
+        """遍历样本
+        Args:
+            outcome: 仅遍历该识别结果的样本, 为None时遍历全部
+        Returns:
+            Iterator[tuple]: (样本id, 验证码数据, 识别结果, 识别中间结果)
+        """
+        sql = "SELECT id, outcome, bg_img, ptr_img, word_count, trace FROM samples"
+        params = ()
+        if outcome is not None:
+            sql += " WHERE outcome = ?"
+            params = (outcome.value,)
+        for sample_id, sample_outcome, bg_img, ptr_img, word_count, trace in self.conn.execute(
+            sql + " ORDER BY id", params
+        ):
+            captcha = CaptchaModule(
+                bigImage=base64.b64encode(bg_img).decode(),
+                smallImage=base64.b64encode(ptr_img).decode(),
+                secretKey="",
+                uuid="",
+                wordCount=word_count,
+            )
+            trace = None if trace is None else json.loads(trace)
+            yield sample_id, captcha, CaptchaOutcome(sample_outcome), trace
+
+
+@cache
+def default_corpus() -> CaptchaCorpus | None:
+    "由环境变量 ICPQUERY_CAPTCHA_CORPUS 指定的进程内共享样本库, 未设置时为None"
+    if CORPUS_PATH is None:
+        return None
+    return CaptchaCorpus(CORPUS_PATH)
+
+
+def same_answer(points: list, recorded: list, tolerance: float = 5.0) -> bool:
+    "两次识别的点选坐标是否一致"
+    return len(points) == len(recorded) and all(
+        math.dist(a, b) <= tolerance for a, b in zip(points, recorded)
+    )
+
+
+def replay(
+    corpus: CaptchaCorpus, outcome: CaptchaOutcome | None = None
+) -> dict[CaptchaOutcome, Counter[ReplayOutcome]]:
+    """使用当前识别逻辑离线回放样本库
+    校验通过的样本答案变化说明可能退化, 识别失败或校验未通过的样本得到新答案说明可能改进;
+    回放不学习未知底图, 不改变学习器状态, 结果与样本顺序无关
+    Args:
+        corpus: 样本库
+        outcome: 仅回放该识别结果的样本, 为None时回放全部
+    Returns:
+        dict: {记录的识别结果: {回放结果: 样本数}}
+    """
+    summary: dict[CaptchaOutcome, Counter[ReplayOutcome]] = {}
+    for _, captcha, recorded_outcome, recorded_trace in corpus.iter_samples(outcome):
+        trace = SolveTrace()
+        points = fuck_captcha(captcha, trace, learn=False)
+        recorded_points = (recorded_trace or {}).get("points") or []
+        if points is None:
+            result = ReplayOutcome.UNSOLVED
+        elif recorded_outcome != CaptchaOutcome.UNSOLVED and same_answer(trace.points, recorded_points):
+            result = ReplayOutcome.SAME
+        else:
+            result = ReplayOutcome.DIFFERENT
+        summary.setdefault(recorded_outcome, Counter())[result] += 1
+    return summary
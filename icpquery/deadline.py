@@ -0,0 +1,76 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from .exceptions import ICPQueryTimeout
+
+
+class Deadline:
+    """总耗时预算
+    在鉴权、验证码识别与查询各阶段间传递, 限制单次HTTP请求超时与重试等待, 预算耗尽时抛出 ICPQueryTimeout
+    """
+
+    def __init__(self, timeout: float | None = None) -> None:
+        """
+        Args:
+            timeout: 总耗时预算(秒), 为None时不限制
+        """
+        self.timeout = timeout
+        self.expires_at = None if timeout is None else time.monotonic() + timeout
+
+    def remaining(self) -> float | None:
+        """剩余时间
+        Returns:
+            float | None: 剩余秒数, 不限制时为None
+        """
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, need: float = 0.0):
+        """剩余时间不足时抛出 ICPQueryTimeout
+        Args:
+            need: 后续操作预计需要的时间(秒)
+        """
+        remaining = self.remaining()
+        if remaining is not None and (remaining <= 0.0 or remaining < need):
+            raise ICPQueryTimeout(self.timeout)
+
+    def cap(self, seconds: float, reserve: float = 0.0) -> float:
+        """将时长限制在剩余时间内
+        Args:
+            seconds: 时长(秒)
+            reserve: 需为后续操作保留的时间(秒)
+        Returns:
+            float: 不超过剩余时间的时长
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return seconds
+        return max(min(seconds, remaining - reserve), 0.0)
+
+    def http_timeout(self, default: float) -> float:
+        """单次HTTP请求超时, 预算已耗尽时抛出 ICPQueryTimeout
+        Args:
+            default: 默认请求超时(秒)
+        Returns:
+            float: 请求超时(秒)
+        """
+        self.check()
+        return self.cap(default)
+
+    @asynccontextmanager
+    async def limit(self):
+        """限制代码块耗时不超过剩余时间, 超时取消并抛出 ICPQueryTimeout
+        HTTP超时只限制单次读写, 服务端持续缓慢发送数据时仍可能超出预算
+        """
+        self.check()
+        try:
+            async with asyncio.timeout(self.remaining()):
+                yield
+        except TimeoutError:
+            raise ICPQueryTimeout(self.timeout)
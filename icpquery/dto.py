@@ -1,23 +1,27 @@
+import asyncio
 import json
 import time
 import uuid
 from hashlib import md5
 from types import TracebackType
-from typing import Optional
+from typing import AsyncIterator, Iterable, Optional
 
 import httpx
 
+from .deadline import Deadline
 from .exceptions import APIError
 from .schema import (
-    BeianAPP,
+    RESULT_MODELS,
+    BeianMultiQueryResp,
     BeianQueryResp,
-    BeianSite,
     CaptchaModule,
     Points,
     SearchType,
 )
 
 API_BASE = "https://hlwicpfwc.miit.gov.cn/icpproject_query/api"
+# 单次HTTP请求默认超时(秒)
+HTTP_TIMEOUT = 20.0
 
 
 class AsyncIcpQueryDto:
@@ -27,12 +31,14 @@ class AsyncIcpQueryDto:
     refresh: str
     captcha: CaptchaModule
     captcha_key: str
+    deadline: Optional[Deadline]
 
     def __init__(
         self,
         client_id: Optional[str] = None,
         token: Optional[str] = None,
         refresh: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
     ) -> None:
         self.client = httpx.AsyncClient(
             headers={
@@ -44,8 +50,9 @@ class AsyncIcpQueryDto:
             },
             follow_redirects=True,
             base_url=API_BASE,
-            timeout=20,
+            timeout=HTTP_TIMEOUT,
         )
+        self.deadline = deadline
         self.token = token
         self.refresh = refresh
         if not client_id:
@@ -65,6 +72,19 @@ class AsyncIcpQueryDto:
     ):
         await self.client.__aexit__()
 
+    def _timeout(self) -> float:
+        "单次HTTP请求超时, 不超过总耗时预算的剩余时间"
+        if self.deadline is None:
+            return HTTP_TIMEOUT
+        return self.deadline.http_timeout(HTTP_TIMEOUT)
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        "发送HTTP请求, 整个请求(含读取响应)不超过总耗时预算的剩余时间"
+        if self.deadline is None:
+            return await self.client.request(method, url, timeout=HTTP_TIMEOUT, **kwargs)
+        async with self.deadline.limit():
+            return await self.client.request(method, url, timeout=self._timeout(), **kwargs)
+
     async def get_token(self, account: str = "test", secret: str = "test"):
         """获取Session Token
         Args:
@@ -72,7 +92,8 @@ class AsyncIcpQueryDto:
             secret:
         """
         ts = int(time.time() * 1000)
-        resp = await self.client.post(
+        resp = await self._request(
+            "POST",
             "/auth",
             data={
                 "authKey": md5(f"{account}{secret}{ts}".encode()).hexdigest(),
@@ -90,7 +111,8 @@ class AsyncIcpQueryDto:
 
     async def refresh_token(self):
         """刷新Session Token"""
-        resp = await self.client.get(
+        resp = await self._request(
+            "GET",
             "/auth/refresh",
             params={
                 "refreshToken": self.refresh,
@@ -110,7 +132,8 @@ class AsyncIcpQueryDto:
         Returns:
             CaptchaModule: 图形验证码数据
         """
-        resp = await self.client.post(
+        resp = await self._request(
+            "POST",
             "/image/getCheckImagePoint",
             headers={
                 "Token": self.token,
@@ -134,7 +157,8 @@ class AsyncIcpQueryDto:
         Returns:
             bool: 是否校验通过
         """
-        resp = await self.client.post(
+        resp = await self._request(
+            "POST",
             "/image/checkImage",
             headers={
                 "Token": self.token,
@@ -160,19 +184,61 @@ class AsyncIcpQueryDto:
         self,
         keyword: str,
         search_type: SearchType,
-        pn: int = 0,
+        pn: int = 1,
         ps: int = 20,
     ) -> BeianQueryResp:
         """通过关键字查询ICP记录
         Args:
             keyword: 关键字
             search_type: 搜索类型
-            pn: 页码
+            pn: 页码 (从1开始)
             ps: 每页数量
         Returns:
             BeianQueryResp: 查询结果
         """
-        resp = await self.client.post(
+        results, _ = await self.query_page(keyword, search_type, pn, ps)
+        return results
+
+    async def iter_query(
+        self,
+        keyword: str,
+        search_type: SearchType,
+        ps: int = 20,
+    ) -> AsyncIterator[BeianQueryResp]:
+        """通过关键字逐页查询ICP记录
+        Args:
+            keyword: 关键字
+            search_type: 搜索类型
+            ps: 每页数量
+        Returns:
+            AsyncIterator[BeianQueryResp]: 每页查询结果
+        """
+        pn = 1
+        while True:
+            results, has_next = await self.query_page(keyword, search_type, pn, ps)
+            yield results
+            if not has_next or not results:
+                break
+            pn += 1
+
+    async def query_page(
+        self,
+        keyword: str,
+        search_type: SearchType,
+        pn: int,
+        ps: int,
+    ) -> tuple[BeianQueryResp, bool]:
+        """查询一页ICP记录
+        Args:
+            keyword: 关键字
+            search_type: 搜索类型
+            pn: 页码 (从1开始)
+            ps: 每页数量
+        Returns:
+            tuple: (查询结果, 是否有下一页)
+        """
+        resp = await self._request(
+            "POST",
             "/icpAbbreviateInfo/queryByCondition",
             headers={
                 "token": self.token,
@@ -197,9 +263,26 @@ class AsyncIcpQueryDto:
             raise APIError(code, json_content["msg"])
         json_content = json_content["params"]
 
-        if search_type == SearchType.DOMAIN:
-            result = [BeianSite.model_validate(r) for r in json_content["list"]]
-        elif search_type == SearchType.APP:
-            result = [BeianAPP.model_validate(r) for r in json_content["list"]]
+        model = RESULT_MODELS[search_type]
+        result = [model.model_validate(r) for r in json_content["list"]]
+
+        return BeianQueryResp(search_type=search_type, results=result), bool(json_content.get("hasNextPage"))
 
-        return BeianQueryResp(search_type=search_type, results=result)
+    async def query_all(
+        self,
+        keyword: str,
+        search_types: Iterable[SearchType] = tuple(SearchType),
+        pn: int = 1,
+        ps: int = 20,
+    ) -> BeianMultiQueryResp:
+        """通过关键字并发查询多种类型的ICP记录, 共用同一会话与验证码
+        Args:
+            keyword: 关键字
+            search_types: 搜索类型列表
+            pn: 页码 (从1开始)
+            ps: 每页数量
+        Returns:
+            BeianMultiQueryResp: 查询结果
+        """
+        responses = await asyncio.gather(*(self.query(keyword, t, pn, ps) for t in search_types))
+        return BeianMultiQueryResp(responses=responses)
@@ -20,3 +20,14 @@ class APIError(ICPQueryError):
 
 class FuckCaptchaFail(ICPQueryError):
     """验证码识别失败"""
+
+
+class ICPQueryTimeout(ICPQueryError):
+    """ICP查询超出总耗时预算"""
+
+    def __init__(self, timeout: float | None = None) -> None:
+        super().__init__()
+        self.timeout = timeout
+
+    def __str__(self) -> str:
+        return f"deadline of {self.timeout}s exceeded"
@@ -0,0 +1,423 @@
+import json
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Callable
+
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 推理后端选择配置文件 (由 icpquery calibrate 生成)
+CONFIG_PATH = Path(os.environ.get("XDG_CONFIG_HOME", Path.home() / ".config")) / "icpquery" / "inference.json"
+
+
+class InferenceBackend:
+    """推理后端基类, 每个实例加载一个模型"""
+
+    name = ""
+
+    def __init__(self, model_file: Path) -> None:
+        self.model_file = model_file
+
+    @classmethod
+    def available(cls, model_file: Path) -> bool:
+        "当前环境是否可使用该后端加载模型"
+        return model_file.exists()
+
+    def run(self, inputs: dict[str, np.ndarray]) -> list[np.ndarray]:
+        """执行推理
+        Args:
+            inputs: {输入名: 张量}
+        Returns:
+            list[ndarray]: 模型输出
+        """
+        raise NotImplementedError
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    "onnxruntime 推理后端"
+
+    name = "onnxruntime"
+
+    def __init__(
+        self,
+        model_file: Path,
+        providers: list[str] | None = None,
+        threads: int | None = None,
+    ) -> None:
+        super().__init__(model_file)
+        # 仅在使用该后端时导入 onnxruntime
+        from onnxruntime import InferenceSession, SessionOptions
+
+        options = SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = InferenceSession(model_file, options, providers=providers)
+
+    @classmethod
+    def available(cls, model_file: Path) -> bool:
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            return False
+        return super().available(model_file)
+
+    def run(self, inputs: dict[str, np.ndarray]) -> list[np.ndarray]:
+        return self.session.run(None, inputs)
+
+
+class OpenCVBackend(InferenceBackend):
+    """OpenCV DNN 推理后端
+    cv2.setNumThreads 作用于整个进程, 指定线程数时只在推理期间生效, 结束后恢复, 不影响预处理
+    """
+
+    name = "opencv"
+
+    def __init__(self, model_file: Path, threads: int | None = None) -> None:
+        super().__init__(model_file)
+        self.threads = threads
+        self.net = cv2.dnn.readNetFromONNX(str(model_file))
+        self.output_names = self.net.getUnconnectedOutLayersNames()
+        # cv2.dnn.Net 不支持多线程同时推理
+        self._lock = threading.Lock()
+
+    def run(self, inputs: dict[str, np.ndarray]) -> list[np.ndarray]:
+        with self._lock:
+            for name, value in inputs.items():
+                self.net.setInput(value, name)
+            if not self.threads:
+                return list(self.net.forward(self.output_names))
+            prev_threads = cv2.getNumThreads()
+            cv2.setNumThreads(self.threads)
+            try:
+                return list(self.net.forward(self.output_names))
+            finally:
+                cv2.setNumThreads(prev_threads)
+
+
+class NumpyBackend(InferenceBackend):
+    """纯 NumPy 推理后端
+    加载由 tools/export_numpy_model.py 从 ONNX 模型导出的同名 .npz 文件, 支持常见的卷积网络算子
+    """
+
+    name = "numpy"
+
+    def __init__(self, model_file: Path) -> None:
+        super().__init__(model_file)
+        with np.load(model_file.with_suffix(".npz")) as data:
+            self.graph = json.loads(data["__graph__"].tobytes())
+            self.tensors = {k: data[k] for k in data.files if k != "__graph__"}
+        for node in self.graph["nodes"]:
+            if node["op"] not in NUMPY_OPS:
+                raise NotImplementedError(f"unsupported op: {node['op']}")
+
+    @classmethod
+    def available(cls, model_file: Path) -> bool:
+        return model_file.with_suffix(".npz").exists()
+
+    def run(self, inputs: dict[str, np.ndarray]) -> list[np.ndarray]:
+        values = {**self.tensors, **inputs}
+        for node in self.graph["nodes"]:
+            args = [values[name] if name else None for name in node["inputs"]]
+            outputs = NUMPY_OPS[node["op"]](*args, **node["attrs"])
+            if not isinstance(outputs, tuple):
+                outputs = (outputs,)
+            values.update(zip(node["outputs"], outputs))
+        return [values[name] for name in self.graph["outputs"]]
+
+
+def _pool_windows(x: np.ndarray, kernel_shape, strides=None, pads=None, pad_value=0.0) -> np.ndarray:
+    strides = strides or [1, 1]
+    if pads and any(pads):
+        x = np.pad(
+            x,
+            ((0, 0), (0, 0), (pads[0], pads[2]), (pads[1], pads[3])),
+            constant_values=pad_value,
+        )
+    win = sliding_window_view(x, kernel_shape, axis=(2, 3))
+    return win[:, :, :: strides[0], :: strides[1]]
+
+
+def _conv(x, w, b=None, strides=None, pads=None, dilations=None, group=1, **_):
+    if group != 1 or (dilations and any(d != 1 for d in dilations)):
+        raise NotImplementedError("grouped/dilated Conv")
+    win = _pool_windows(x, w.shape[2:], strides, pads)
+    y = np.tensordot(win, w, axes=([1, 4, 5], [1, 2, 3])).transpose(0, 3, 1, 2)
+    if b is not None:
+        y = y + b[None, :, None, None]
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+
+def _max_pool(x, kernel_shape, strides=None, pads=None, **_):
+    return _pool_windows(x, kernel_shape, strides, pads, -np.inf).max(axis=(4, 5))
+
+
+def _avg_pool(x, kernel_shape, strides=None, pads=None, **_):
+    return _pool_windows(x, kernel_shape, strides, pads).mean(axis=(4, 5), dtype=np.float32)
+
+
+def _gemm(a, b, c=None, alpha=1.0, beta=1.0, transA=0, transB=0):
+    y = alpha * ((a.T if transA else a) @ (b.T if transB else b))
+    if c is not None:
+        y = y + beta * c
+    return y.astype(np.float32, copy=False)
+
+
+def _batch_norm(x, scale, b, mean, var, epsilon=1e-5, **_):
+    shape = (1, -1) + (1,) * (x.ndim - 2)
+    k = scale / np.sqrt(var + epsilon)
+    return (x * k.reshape(shape) + (b - mean * k).reshape(shape)).astype(np.float32, copy=False)
+
+
+def _reshape(x, shape, allowzero=0):
+    shape = [x.shape[i] if s == 0 and not allowzero else s for i, s in enumerate(shape.tolist())]
+    return x.reshape(shape)
+
+
+def _softmax(x, axis=-1):
+    e = np.exp(x - x.max(axis=axis, keepdims=True))
+    return e / e.sum(axis=axis, keepdims=True)
+
+
+def _unsqueeze(x, axes):
+    # opset 13 起 axes 为输入, 之前为属性
+    return np.expand_dims(x, tuple(np.asarray(axes).tolist()))
+
+
+def _squeeze(x, axes=None):
+    return np.squeeze(x, None if axes is None else tuple(np.asarray(axes).tolist()))
+
+
+NUMPY_OPS: dict[str, Callable] = {
+    "Conv": _conv,
+    "MaxPool": _max_pool,
+    "AveragePool": _avg_pool,
+    "GlobalAveragePool": lambda x: x.mean(axis=(2, 3), keepdims=True),
+    "Gemm": _gemm,
+    "MatMul": lambda a, b: a @ b,
+    "Add": lambda a, b: a + b,
+    "Sub": lambda a, b: a - b,
+    "Mul": lambda a, b: a * b,
+    "Div": lambda a, b: a / b,
+    "Abs": np.abs,
+    "Relu": lambda x: np.maximum(x, 0),
+    "LeakyRelu": lambda x, alpha=0.01: np.where(x > 0, x, x * np.float32(alpha)),
+    "Sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "Softmax": _softmax,
+    "BatchNormalization": _batch_norm,
+    "Flatten": lambda x, axis=1: x.reshape(int(np.prod(x.shape[:axis])), -1),
+    "Reshape": _reshape,
+    "Transpose": lambda x, perm=None: x.transpose(perm),
+    "Concat": lambda *xs, axis: np.concatenate(xs, axis=axis),
+    "Unsqueeze": _unsqueeze,
+    "Squeeze": _squeeze,
+    "Shape": lambda x, **_: np.array(x.shape, dtype=np.int64),
+    "Gather": lambda x, i, axis=0: np.take(x, i, axis=axis),
+    "Cast": lambda x, to=1: x.astype(np.float32 if to == 1 else np.int64),
+    "Identity": lambda x: x,
+    "Dropout": lambda x, *_, **__: x,
+}
+
+# 可用的推理后端
+BACKENDS: dict[str, type[InferenceBackend]] = {
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+    OpenCVBackend.name: OpenCVBackend,
+    NumpyBackend.name: NumpyBackend,
+}
+
+BackendFactory = Callable[[Path], InferenceBackend]
+
+
+class InferenceBatcher:
+    """跨验证码的动态批量推理
+    并发识别的验证码提交的推理请求由后台线程按模型合并为一批执行;
+    达到批量上限、等待超过时间窗口, 或全部进行中的识别都在等待结果时立即执行, 单个识别时不增加延迟;
+    模型不支持批量输入时回退为逐个执行
+    """
+
+    def __init__(self, max_batch: int = 64, window: float = 0.003) -> None:
+        """
+        Args:
+            max_batch: 单批最大请求数
+            window: 首个请求最长等待时间(秒)
+        """
+        self.max_batch = max_batch
+        self.window = window
+        # 统计: 执行批次数与请求数
+        self.batches = 0
+        self.items = 0
+        self._queue: list[tuple[InferenceBackend, dict[str, np.ndarray], Future]] = []
+        self._first_at = 0.0
+        # 进行中的识别数与其中等待推理结果的数量
+        self._active = 0
+        self._waiting = 0
+        self._unbatchable: set[InferenceBackend] = set()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    @contextmanager
+    def session(self):
+        "标记一次识别进行中, 期间提交的请求会等待同批的其他识别"
+        with self._cond:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify()
+
+    def run_many(self, backend: InferenceBackend, feeds: list[dict[str, np.ndarray]]) -> list[np.ndarray]:
+        """提交一组推理请求并等待结果
+        Args:
+            backend: 推理后端
+            feeds: 输入列表, 每项批量维度为1
+        Returns:
+            list[ndarray]: 每项的第一个模型输出
+        """
+        if not feeds:
+            return []
+        futures = [Future() for _ in feeds]
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="icpquery-batcher", daemon=True)
+                self._thread.start()
+            if not self._queue:
+                self._first_at = time.perf_counter()
+            self._queue.extend((backend, feed, future) for feed, future in zip(feeds, futures))
+            self._waiting += 1
+            self._cond.notify()
+        try:
+            return [future.result() for future in futures]
+        finally:
+            with self._cond:
+                self._waiting -= 1
+
+    def _ready(self) -> bool:
+        return (
+            len(self._queue) >= self.max_batch
+            or self._waiting >= self._active
+            or time.perf_counter() - self._first_at >= self.window
+        )
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not (self._queue and self._ready()):
+                    if self._queue:
+                        self._cond.wait(max(self._first_at + self.window - time.perf_counter(), 0.0))
+                    else:
+                        self._cond.wait()
+                batch, self._queue = self._queue[: self.max_batch], self._queue[self.max_batch :]
+                self._first_at = time.perf_counter()
+            self.batches += 1
+            self.items += len(batch)
+
+            groups: dict[InferenceBackend, list[tuple[dict, Future]]] = {}
+            for backend, feed, future in batch:
+                groups.setdefault(backend, []).append((feed, future))
+            for backend, items in groups.items():
+                try:
+                    outputs = self._run_group(backend, [feed for feed, _ in items])
+                except BaseException as e:
+                    for _, future in items:
+                        future.set_exception(e)
+                else:
+                    for (_, future), output in zip(items, outputs):
+                        future.set_result(output)
+
+    def _run_group(self, backend: InferenceBackend, feeds: list[dict[str, np.ndarray]]) -> list[np.ndarray]:
+        if len(feeds) > 1 and backend not in self._unbatchable:
+            try:
+                output = backend.run(
+                    {name: np.concatenate([feed[name] for feed in feeds]) for name in feeds[0]}
+                )[0]
+                if output.shape[0] != len(feeds):
+                    raise ValueError("batch size mismatch")
+                return [output[i : i + 1] for i in range(len(feeds))]
+            except Exception:
+                # 模型输入为固定批量
+                self._unbatchable.add(backend)
+        return [backend.run(feed)[0] for feed in feeds]
+
+
+def _read_config() -> dict:
+    try:
+        return json.loads(CONFIG_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {"backend": OnnxRuntimeBackend.name, "options": {}}
+
+
+def _write_config(config: dict):
+    CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    CONFIG_PATH.write_text(json.dumps(config), encoding="utf-8")
+
+
+def load_backend_config() -> dict:
+    """读取推理后端选择, 环境变量 ICPQUERY_INFERENCE_BACKEND 优先
+    Returns:
+        dict: {"backend": 后端名, "options": 后端参数}
+    """
+    if name := os.environ.get("ICPQUERY_INFERENCE_BACKEND"):
+        return {"backend": name, "options": {}}
+    return _read_config()
+
+
+def save_backend_config(name: str, options: dict):
+    "保存推理后端选择"
+    _write_config({**_read_config(), "backend": name, "options": options})
+
+
+def save_batch_config(enabled: bool):
+    "保存是否启用跨验证码批量推理"
+    _write_config({**_read_config(), "batch": enabled})
+
+
+def batcher_from_config() -> InferenceBatcher | None:
+    """按配置创建批量推理器, 环境变量 ICPQUERY_INFERENCE_BATCH (1/0) 优先
+    Returns:
+        InferenceBatcher | None: 未启用时为None
+    """
+    if (env := os.environ.get("ICPQUERY_INFERENCE_BATCH")) is not None:
+        enabled = env.strip().lower() not in ("", "0", "false", "no")
+    else:
+        enabled = _read_config().get("batch", False)
+    return InferenceBatcher() if enabled else None
+
+
+def backend_factory(name: str | None = None, options: dict | None = None) -> BackendFactory:
+    """获取推理后端构造函数
+    Args:
+        name: 后端名, 为None时使用已保存的选择, 该后端不可用时回退到首个可用的后端
+        options: 后端参数
+    Returns:
+        Callable: 模型路径 -> 推理后端实例
+    """
+    if name is not None:
+        return partial(BACKENDS[name], **(options or {}))
+    config = load_backend_config()
+    return partial(_configured_backend, config.get("backend"), config.get("options") or {})
+
+
+def _configured_backend(name: str | None, options: dict, model_file: Path) -> InferenceBackend:
+    "按配置加载推理后端, 后端名无效或当前环境不可用时回退到首个可用的后端并警告"
+    backend = BACKENDS.get(name)
+    if backend is not None and backend.available(model_file):
+        return backend(model_file, **options)
+    for fallback in BACKENDS.values():
+        if fallback.available(model_file):
+            reason = "unknown" if backend is None else "unavailable"
+            warnings.warn(
+                f"inference backend {name!r} is {reason} for {model_file.name}, using {fallback.name!r}",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+            return fallback(model_file)
+    raise FileNotFoundError(f"no inference backend can load {model_file}")
@@ -0,0 +1,136 @@
+import hashlib
+import threading
+from collections import deque
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+def pixel_agreement(img_a_gray: np.ndarray, img_b_gray: np.ndarray, tolerance: int = 0) -> float:
+    """计算两张灰度图片中取值相同的像素比例
+    Args:
+        img_a_gray: 灰度图片A
+        img_b_gray: 灰度图片B
+        tolerance: 允许的像素差
+    Returns:
+        float: 相同像素比例(越大越相似)
+    """
+    if img_a_gray.shape != img_b_gray.shape:
+        return 0.0
+    return np.count_nonzero(cv2.absdiff(img_a_gray, img_b_gray) <= tolerance) / img_a_gray.size
+
+
+class BackgroundLearner:
+    """未知底图在线学习
+    无法识别背景的验证码底图放入有界缓冲区并按相似度聚类, 同一底图的样本数足够且每个像素都有过半样本取值相同时,
+    逐像素取中位数去除文字得到干净的底图模板, 加入运行时底图库并可保存为PNG;
+    保存的模板在下次启动时自动加载, 人工确认后可加入 backgrounds 目录与 CpatchaBackguard
+    """
+
+    def __init__(
+        self,
+        path: Path | None = None,
+        buffer_size: int = 32,
+        min_samples: int = 5,
+        cluster_agreement: float = 0.8,
+        template_agreement: float = 0.8,
+    ) -> None:
+        """
+        Args:
+            path: 学习到的底图模板保存目录, 为None时不保存
+            buffer_size: 未识别底图缓冲区大小
+            min_samples: 生成模板所需的同一底图样本数
+            cluster_agreement: 样本归为同一底图所需的相同像素比例 (允许少量像素差)
+            template_agreement: 识别底图时与模板严格相同的像素比例下限
+        """
+        self.path = path
+        self.min_samples = min_samples
+        self.cluster_agreement = cluster_agreement
+        self.template_agreement = template_agreement
+        # [(彩色图, 灰度图)]
+        self._samples: deque[tuple[np.ndarray, np.ndarray]] = deque(maxlen=buffer_size)
+        # {模板名: (彩色图, 灰度图)}
+        self._templates: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self._lock = threading.Lock()
+        if path is not None and path.is_dir():
+            for file in sorted(path.glob("*.png")):
+                img = cv2.imread(str(file), cv2.IMREAD_COLOR)
+                if img is not None:
+                    self._add_template(file.stem, img)
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._templates
+
+    def _add_template(self, name: str, img: np.ndarray):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        img.flags.writeable = False
+        gray.flags.writeable = False
+        self._templates[name] = (img, gray)
+
+    def template(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        """获取学习到的底图模板 (只读)
+        Returns:
+            tuple: (彩色图, 灰度图)
+        """
+        return self._templates[name]
+
+    def match(self, img_gray: np.ndarray) -> str | None:
+        """在学习到的底图模板中识别背景
+        Args:
+            img_gray: 验证码底图灰度图
+        Returns:
+            str | None: 模板名, 未识别时为None
+        """
+        for name, (_, gray) in list(self._templates.items()):
+            if pixel_agreement(gray, img_gray) >= self.template_agreement:
+                return name
+        return None
+
+    def observe(self, img: np.ndarray) -> str | None:
+        """记录一张无法识别背景的验证码底图, 同一底图样本数足够时生成模板
+        Args:
+            img: 验证码底图
+        Returns:
+            str | None: 可用于该底图的模板名, 尚无法生成时为None
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        with self._lock:
+            # 其他线程可能已学习到该底图
+            if (name := self.match(gray)) is not None:
+                return name
+
+            cluster = [
+                sample
+                for sample in self._samples
+                if pixel_agreement(sample[1], gray, tolerance=2) >= self.cluster_agreement
+            ]
+            cluster.append((img, gray))
+            if len(cluster) < self.min_samples:
+                self._samples.append((img, gray))
+                return None
+
+            # 文字位置各不相同, 逐像素取下中位数即为底图原始像素值;
+            # 存在未被过半样本共同取值的像素时, 说明文字重叠过多, 继续收集样本
+            stack = np.stack([bgr for bgr, _ in cluster])
+            k = (len(cluster) - 1) // 2
+            template = np.ascontiguousarray(np.partition(stack, k, axis=0)[k])
+            support = np.count_nonzero((stack == template).all(axis=3), axis=0)
+            if support.min() * 2 <= len(cluster):
+                self._samples.append((img, gray))
+                return None
+
+            name = f"learned_{hashlib.blake2b(template.tobytes(), digest_size=4).hexdigest()}"
+            self._add_template(name, template)
+            members = {id(bgr) for bgr, _ in cluster}
+            remaining = [sample for sample in self._samples if id(sample[0]) not in members]
+            self._samples.clear()
+            self._samples.extend(remaining)
+
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            cv2.imwrite(str(self.path / f"{name}.png"), template)
+        return name
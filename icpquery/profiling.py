@@ -0,0 +1,221 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from types import FrameType
+
+_active_profiler: ContextVar["Profiler | None"] = ContextVar("icpquery_profiler", default=None)
+
+
+def _track_name() -> str:
+    "当前线程/协程任务名, 用于区分并发的阶段计时"
+    name = threading.current_thread().name
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        name = f"{name}/{task.get_name()}"
+    return name
+
+
+@contextmanager
+def stage(name: str):
+    """记录一个处理阶段的耗时, 未启用性能分析时无开销
+    Args:
+        name: 阶段名
+    """
+    profiler = _active_profiler.get()
+    if profiler is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add_stage(name, start, time.perf_counter())
+
+
+class Profiler:
+    """性能分析器
+    后台线程按固定间隔采样全部线程调用栈, 同时记录各处理阶段耗时;
+    结果可保存为火焰图折叠栈格式(.folded/.txt)或 speedscope JSON(.json)
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.start_time = 0.0
+        self.end_time = 0.0
+        # {线程名: [(调用栈, 权重)]}
+        self.samples: dict[str, list[tuple[tuple[tuple[str, str, int], ...], float]]] = defaultdict(list)
+        # [(阶段名, 轨道名, 开始, 结束)]
+        self.stage_events: list[tuple[str, str, float, float]] = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._token = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self._token = _active_profiler.set(self)
+        self._thread = threading.Thread(target=self._sample_loop, name="icpquery-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self.end_time = time.perf_counter()
+        try:
+            _active_profiler.reset(self._token)
+        except ValueError:
+            # 在其他上下文中停止 (如命令行退出时)
+            _active_profiler.set(None)
+
+    def add_stage(self, name: str, start: float, end: float, track: str | None = None):
+        "记录阶段耗时"
+        with self._lock:
+            self.stage_events.append((name, track or _track_name(), start, end))
+
+    @property
+    def stages(self) -> dict[str, tuple[int, float]]:
+        """各阶段汇总
+        Returns:
+            dict: {阶段名: (次数, 总耗时秒)}
+        """
+        summary: dict[str, tuple[int, float]] = {}
+        for name, _, start, end in self.stage_events:
+            cnt, total = summary.get(name, (0, 0.0))
+            summary[name] = (cnt + 1, total + end - start)
+        return summary
+
+    def _sample_loop(self):
+        own_ident = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                self.samples[names.get(ident, str(ident))].append((self._walk(frame), weight))
+
+    @staticmethod
+    def _walk(frame: FrameType | None) -> tuple[tuple[str, str, int], ...]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def to_collapsed(self) -> str:
+        "火焰图折叠栈格式 (每行: 线程;帧;帧 毫秒数)"
+        counter: Counter[str] = Counter()
+        for thread_name, samples in self.samples.items():
+            for stack, weight in samples:
+                frames = ";".join(f"{name} ({Path(file).name}:{line})" for name, file, line in stack)
+                counter[f"{thread_name};{frames}"] += weight
+        return "".join(f"{stack} {round(weight * 1000)}\n" for stack, weight in counter.items())
+
+    def to_speedscope(self) -> dict:
+        "speedscope 格式, 每个线程一个采样 profile, 每个轨道一个阶段耗时 profile"
+        frames: list[dict] = []
+        frame_index: dict[tuple, int] = {}
+
+        def frame_id(key: tuple) -> int:
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                name, file, line = key
+                frames.append({"name": name, "file": file, "line": line})
+            return frame_index[key]
+
+        duration = self.end_time - self.start_time
+        profiles = []
+        for thread_name, samples in self.samples.items():
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": thread_name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": duration,
+                    "samples": [[frame_id(key) for key in stack] for stack, _ in samples],
+                    "weights": [weight for _, weight in samples],
+                }
+            )
+
+        tracks: dict[str, list] = defaultdict(list)
+        for name, track, start, end in self.stage_events:
+            fid = frame_id((name, "<stage>", 0))
+            tracks[track].append((start - self.start_time, 1, fid))
+            tracks[track].append((end - self.start_time, 0, fid))
+        for track, events in tracks.items():
+            # 同一时刻先关闭再打开, 保证事件嵌套
+            events.sort(key=lambda e: (e[0], e[1]))
+            profiles.append(
+                {
+                    "type": "evented",
+                    "name": f"stages {track}",
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": duration,
+                    "events": [
+                        {"type": "O" if kind else "C", "frame": fid, "at": at} for at, kind, fid in events
+                    ],
+                }
+            )
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": "icpquery",
+            "exporter": "icpquery",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def save(self, path: str | Path):
+        """保存分析结果, 按扩展名选择格式
+        Args:
+            path: .json 为 speedscope 格式, 其他为折叠栈格式
+        """
+        path = Path(path)
+        if path.suffix == ".json":
+            path.write_text(json.dumps(self.to_speedscope()), encoding="utf-8")
+        else:
+            path.write_text(self.to_collapsed(), encoding="utf-8")
+
+
+@contextmanager
+def profile(path: str | Path | None = None, interval: float = 0.005):
+    """性能分析上下文管理器
+    Args:
+        path: 结果保存路径, 为None时不保存
+        interval: 采样间隔(秒)
+    Returns:
+        Profiler: 性能分析器
+    """
+    profiler = Profiler(interval)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        if path is not None:
+            profiler.save(path)
@@ -5,9 +5,9 @@ from typing import Sequence
 
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
-from pydantic import BaseModel, Field, RootModel
-from rich.columns import Columns
+from pydantic import AliasChoices, BaseModel, Field, RootModel, ValidationInfo, field_validator
 from rich.console import Console, ConsoleOptions, RenderResult
+from rich.panel import Panel
 from rich.table import Table
 
 
@@ -191,9 +191,122 @@ class BeianAPP(BaseModel):
     update_record_time: datetime = Field(alias="updateRecordTime", description="审核通过日期")
 
 
+class BeianMiniProg(BaseModel):
+    """小程序备案查询结果"""
+
+    data_id: int = Field(alias="dataId", description="")
+    leader_name: str = Field("", alias="leaderName", description="企业代表")
+    main_unit_address: str = Field("", alias="mainUnitAddress", description="单位地址")
+    service_name: str = Field(alias="serviceName", description="小程序名称")
+    service_type: int = Field(alias="serviceType", description="")
+
+    content_type_name: str = Field("", alias="contentTypeName", description="前置审批项")
+    main_id: int = Field(alias="mainId", description="主体备案id")
+    main_licence: str = Field(alias="mainLicence", description="主体备案号")
+    nature_name: str = Field(alias="natureName", description="主办单位性质")
+    service_id: int = Field(alias="serviceId", description="ICP备案id")
+    service_licence: str = Field(alias="serviceLicence", description="ICP备案号")
+    unit_name: str = Field(alias="unitName", description="主体名称")
+    update_record_time: datetime = Field(alias="updateRecordTime", description="审核通过日期")
+
+
+class BeianFastProg(BeianMiniProg):
+    """快应用备案查询结果"""
+
+    service_name: str = Field(alias="serviceName", description="快应用名称")
+
+
+# 各搜索类型对应的查询结果模型
+RESULT_MODELS: dict[SearchType, type[BaseModel]] = {
+    SearchType.DOMAIN: BeianSite,
+    SearchType.APP: BeianAPP,
+    SearchType.MINI_PROG: BeianMiniProg,
+    SearchType.FAST_PROG: BeianFastProg,
+}
+
+# 各搜索类型名称
+SEARCH_TYPE_NAMES: dict[SearchType, str] = {
+    SearchType.DOMAIN: "域名",
+    SearchType.APP: "APP",
+    SearchType.MINI_PROG: "小程序",
+    SearchType.FAST_PROG: "快应用",
+}
+
+
+def record_rows(search_type: SearchType, result: BaseModel) -> list[tuple[str, str]]:
+    """备案记录展示字段
+    Args:
+        search_type: 搜索类型
+        result: 备案记录
+    Returns:
+        list[tuple]: (字段名, 值) 列表
+    """
+    if search_type == SearchType.DOMAIN:
+        rows = [
+            ("网站域名", result.domain),
+            ("备案号", result.service_licence),
+            ("主体名称", result.unit_name),
+            ("主体性质", result.nature_name),
+            ("主体备案号", result.main_licence),
+            ("限制接入", result.limit_access),
+        ]
+    elif search_type == SearchType.APP:
+        rows = [
+            ("APP名称", result.service_name),
+            ("备案号", result.service_licence),
+            ("前置审批项", result.content_type_name),
+            ("主体名称", result.unit_name),
+            ("主体性质", result.nature_name),
+            ("主体代表", result.leader_name),
+            ("主体地址", result.main_unit_address),
+            ("主体备案号", result.main_licence),
+        ]
+    else:
+        rows = [
+            (f"{SEARCH_TYPE_NAMES[search_type]}名称", result.service_name),
+            ("备案号", result.service_licence),
+            ("主体名称", result.unit_name),
+            ("主体性质", result.nature_name),
+            ("主体备案号", result.main_licence),
+        ]
+    rows.append(("通过日期", result.update_record_time.strftime("%Y-%m-%d %H:%M:%S")))
+    return rows
+
+
+def records_table(search_type: SearchType, results: Sequence[BaseModel], title: str | None = None) -> Table:
+    """备案记录紧凑表格, 每条记录一行
+    Args:
+        search_type: 搜索类型
+        results: 备案记录列表
+        title: 表格标题
+    Returns:
+        Table: 表格
+    """
+    tb = Table(title=title, title_justify="left", header_style="green", expand=False)
+    for i, result in enumerate(results):
+        rows = record_rows(search_type, result)
+        if i == 0:
+            for k, _ in rows:
+                tb.add_column(k, overflow="fold")
+        tb.add_row(*(v for _, v in rows))
+    return tb
+
+
 class BeianQueryResp(BaseModel):
-    search_type: SearchType = Field(serialization_alias="searchType")
-    results: list[BeianSite | BeianAPP]
+    search_type: SearchType = Field(
+        serialization_alias="searchType",
+        validation_alias=AliasChoices("search_type", "searchType"),
+    )
+    results: list[BeianSite | BeianAPP | BeianMiniProg | BeianFastProg]
+
+    @field_validator("results", mode="before")
+    @classmethod
+    def _validate_results(cls, value, info: ValidationInfo):
+        # 按搜索类型选择记录模型, APP/小程序/快应用字段相近无法自动区分
+        model = RESULT_MODELS.get(info.data.get("search_type"))
+        if model is None:
+            return value
+        return [r if isinstance(r, BaseModel) else model.model_validate(r) for r in value]
 
     def __bool__(self):
         return len(self.results) > 0
@@ -202,31 +315,7 @@ class BeianQueryResp(BaseModel):
         return iter(self.results)
 
     def __rich_console__(self, console: Console, options: ConsoleOptions) -> RenderResult:
-        col = Columns()
-        for result in self.results:
-            tb = Table(show_header=False)
-            if self.search_type == SearchType.DOMAIN:
-                tb.add_row("[green]网站域名", result.domain)
-                tb.add_row("[green]备案号", result.service_licence)
-                tb.add_row("[green]主体名称", result.unit_name)
-                tb.add_row("[green]主体性质", result.nature_name)
-                tb.add_row("[green]主体备案号", result.main_licence)
-                tb.add_row("[green]限制接入", result.limit_access)
-            elif self.search_type == SearchType.APP:
-                tb.add_row("[green]APP名称", result.service_name)
-                tb.add_row("[green]备案号", result.service_licence)
-                tb.add_row("[green]前置审批项", result.content_type_name)
-                tb.add_row("[green]主体名称", result.unit_name)
-                tb.add_row("[green]主体性质", result.nature_name)
-                tb.add_row("[green]主体代表", result.leader_name)
-                tb.add_row("[green]主体地址", result.main_unit_address)
-                tb.add_row("[green]主体备案号", result.main_licence)
-            tb.add_row(
-                "[green]通过日期",
-                result.update_record_time.strftime("%Y-%m-%d %H:%M:%S"),
-            )
-            col.add_renderable(tb)
-        yield col
+        yield records_table(self.search_type, self.results)
 
     def to_json(self) -> str:
         return self.model_dump_json(by_alias=True)
@@ -235,30 +324,44 @@ class BeianQueryResp(BaseModel):
         if self.results:
             lines = []
             for result in self.results:
-                if self.search_type == SearchType.DOMAIN:
-                    lines.append(("网站域名", result.domain))
-                    lines.append(("备案号", result.service_licence))
-                    lines.append(("主体名称", result.unit_name))
-                    lines.append(("主体性质", result.nature_name))
-                    lines.append(("主体备案号", result.main_licence))
-                    lines.append(("限制接入", result.limit_access))
-                elif self.search_type == SearchType.APP:
-                    lines.append(("APP名称", result.service_name))
-                    lines.append(("备案号", result.service_licence))
-                    lines.append(("前置审批项", result.content_type_name))
-                    lines.append(("主体名称", result.unit_name))
-                    lines.append(("主体性质", result.nature_name))
-                    lines.append(("主体代表", result.leader_name))
-                    lines.append(("主体地址", result.main_unit_address))
-                    lines.append(("主体备案号", result.main_licence))
-                lines.append(
-                    (
-                        "通过日期",
-                        result.update_record_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    )
-                )
+                lines.extend(record_rows(self.search_type, result))
                 lines.append((None, None))
             lines.pop()
             return "\n".join(f"{k}{kv_delimiter}{v}" if k is not None else record_delimiter for k, v in lines)
         else:
             return "未查询到该备案"
+
+
+class BeianMultiQueryResp(BaseModel):
+    """多类型查询结果"""
+
+    responses: list[BeianQueryResp]
+
+    def __bool__(self):
+        return any(self.responses)
+
+    def __iter__(self):
+        "遍历 (搜索类型, 备案记录)"
+        for resp in self.responses:
+            for result in resp:
+                yield resp.search_type, result
+
+    def __rich_console__(self, console: Console, options: ConsoleOptions) -> RenderResult:
+        for resp in self.responses:
+            if resp:
+                yield Panel(
+                    resp, title=f"[green]{SEARCH_TYPE_NAMES[resp.search_type]}备案", title_align="left"
+                )
+
+    def to_json(self) -> str:
+        return "[" + ",".join(resp.to_json() for resp in self.responses) + "]"
+
+    def to_text(self, kv_delimiter=": ", record_delimiter="-" * 20) -> str:
+        if self:
+            return f"\n{'=' * 20}\n".join(
+                f"[{SEARCH_TYPE_NAMES[resp.search_type]}]\n{resp.to_text(kv_delimiter, record_delimiter)}"
+                for resp in self.responses
+                if resp
+            )
+        else:
+            return "未查询到该备案"
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+from .captcha import warmup
+from .coalesce import SingleFlight
+from .deadline import Deadline
+from .dto import AsyncIcpQueryDto
+from .exceptions import ICPHTTPError, ICPQueryError, ICPQueryTimeout
+from .schema import BeianMultiQueryResp, BeianQueryResp, SearchType
+from .utils import resolve_captcha
+
+
+class TTLCache:
+    """查询结果缓存 (LRU + 过期时间)"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[tuple, tuple[float, BeianQueryResp]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: tuple) -> BeianQueryResp | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: tuple, value: BeianQueryResp):
+        if self.ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class SessionPool:
+    """已鉴权的查询会话池, 复用Session Token"""
+
+    def __init__(self, token_ttl: float = 300.0) -> None:
+        self.token_ttl = token_ttl
+        self._idle: list[tuple[float, AsyncIcpQueryDto]] = []
+
+    async def acquire(self, deadline: Deadline | None = None) -> tuple[float, AsyncIcpQueryDto]:
+        """取出一个可用会话, 无可用会话或Token过期时重新鉴权
+        Args:
+            deadline: 总耗时预算, 同时限制鉴权
+        Returns:
+            tuple: (鉴权时间, 会话)
+        """
+        while self._idle:
+            created, dto = self._idle.pop()
+            if time.monotonic() - created < self.token_ttl:
+                dto.deadline = deadline
+                return created, dto
+            await dto.__aexit__()
+        dto = AsyncIcpQueryDto(deadline=deadline)
+        await dto.__aenter__()
+        try:
+            await dto.get_token()
+        except BaseException:
+            await dto.__aexit__()
+            raise
+        return time.monotonic(), dto
+
+    def release(self, session: tuple[float, AsyncIcpQueryDto]):
+        "归还会话"
+        self._idle.append(session)
+
+    async def discard(self, session: tuple[float, AsyncIcpQueryDto]):
+        "丢弃出错的会话"
+        await session[1].__aexit__()
+
+    async def close(self):
+        while self._idle:
+            _, dto = self._idle.pop()
+            await dto.__aexit__()
+
+
+class IcpQueryServer:
+    """常驻ICP查询HTTP服务
+    进程内保持已加载的模型与底图、已鉴权的会话与查询结果缓存
+
+    接口:
+        GET /query?keyword=...&type=domain  查询ICP备案记录 (type=all 查询全部类型)
+        GET /health                         健康检查
+        GET /metrics                        运行指标
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_concurrency: int = 4,
+        max_pending: int = 64,
+        cache_ttl: float = 600.0,
+        cache_size: int = 1024,
+        token_ttl: float = 300.0,
+        captcha_max_retry: int = 10,
+        captcha_fail_delay: float = 2.0,
+        query_timeout: float | None = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        self.captcha_max_retry = captcha_max_retry
+        self.captcha_fail_delay = captcha_fail_delay
+        self.query_timeout = query_timeout
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.sessions = SessionPool(token_ttl)
+        self.flight = SingleFlight()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.pending = 0
+        self.started_at = time.time()
+        self.metrics = {
+            "requests": 0,
+            "cache_hits": 0,
+            "coalesced": 0,
+            "queries_ok": 0,
+            "queries_failed": 0,
+            "queries_rejected": 0,
+            "queries_timeout": 0,
+            "captcha_attempts": 0,
+            "query_seconds_total": 0.0,
+        }
+
+    async def query(
+        self, keyword: str, search_type: SearchType | None
+    ) -> BeianQueryResp | BeianMultiQueryResp:
+        """查询ICP备案记录 (优先使用缓存)
+        Args:
+            keyword: 关键词
+            search_type: 搜索类型, None为全部类型
+        Returns:
+            BeianQueryResp | BeianMultiQueryResp: 查询结果
+        """
+        key = (keyword, search_type)
+        if (results := self.cache.get(key)) is not None:
+            self.metrics["cache_hits"] += 1
+            return results
+
+        if key in self.flight:
+            self.metrics["coalesced"] += 1
+        # 在首次等待前占用排队名额, 同一轮事件循环中到达的请求不会同时通过 max_pending 检查
+        self.pending += 1
+        try:
+            return await self.flight.do(key, lambda: self._query(keyword, search_type))
+        finally:
+            self.pending -= 1
+
+    async def _query(
+        self, keyword: str, search_type: SearchType | None
+    ) -> BeianQueryResp | BeianMultiQueryResp:
+        "限制并发执行查询并缓存结果"
+        # 耗时预算包含排队等待时间
+        deadline = Deadline(self.query_timeout)
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                deadline.check()
+                results = await self.fetch(keyword, search_type, deadline)
+            except Exception:
+                self.metrics["queries_failed"] += 1
+                raise
+            finally:
+                self.metrics["query_seconds_total"] += time.perf_counter() - start
+
+        self.metrics["queries_ok"] += 1
+        self.cache.put((keyword, search_type), results)
+        return results
+
+    async def fetch(
+        self, keyword: str, search_type: SearchType | None, deadline: Deadline | None = None
+    ) -> BeianQueryResp | BeianMultiQueryResp:
+        "使用池中会话执行一次查询"
+
+        def on_captcha_try(count: int):
+            self.metrics["captcha_attempts"] += 1
+
+        deadline = deadline or Deadline()
+        try:
+            session = await self.sessions.acquire(deadline)
+            dto = session[1]
+            try:
+                await resolve_captcha(dto, on_captcha_try, self.captcha_max_retry, self.captcha_fail_delay)
+                if search_type is None:
+                    results = await dto.query_all(keyword)
+                else:
+                    results = await dto.query(keyword, search_type)
+            except BaseException:
+                await self.sessions.discard(session)
+                raise
+            finally:
+                dto.deadline = None
+        except httpx.HTTPError:
+            deadline.check()
+            raise ICPHTTPError
+        self.sessions.release(session)
+        return results
+
+    async def dispatch(self, method: str, target: str) -> tuple[HTTPStatus, dict | str]:
+        """路由HTTP请求
+        Returns:
+            tuple: (状态码, 响应数据)
+        """
+        url = urlsplit(target)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if method != "GET":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "method not allowed"}
+
+        if url.path == "/health":
+            return HTTPStatus.OK, {"status": "ok"}
+        elif url.path == "/metrics":
+            return HTTPStatus.OK, {
+                **self.metrics,
+                "uptime": round(time.time() - self.started_at, 3),
+                "cache_size": len(self.cache),
+                "pending": self.pending,
+            }
+        elif url.path == "/query":
+            keyword = params.get("keyword")
+            if not keyword:
+                return HTTPStatus.BAD_REQUEST, {"error": "missing keyword"}
+            type_name = params.get("type", "domain").upper()
+            try:
+                search_type = None if type_name == "ALL" else SearchType[type_name]
+            except KeyError:
+                return HTTPStatus.BAD_REQUEST, {"error": "invalid type"}
+            if self.pending >= self.max_pending:
+                self.metrics["queries_rejected"] += 1
+                return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "too many pending queries"}
+            try:
+                results = await self.query(keyword, search_type)
+            except ICPQueryTimeout as e:
+                self.metrics["queries_timeout"] += 1
+                return HTTPStatus.GATEWAY_TIMEOUT, {"error": type(e).__name__, "detail": str(e)}
+            except ICPQueryError as e:
+                return HTTPStatus.BAD_GATEWAY, {"error": type(e).__name__, "detail": str(e)}
+            except Exception as e:
+                # 接口返回结构变化等未预期的错误
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": type(e).__name__, "detail": str(e)}
+            return HTTPStatus.OK, results.to_json()
+        else:
+            return HTTPStatus.NOT_FOUND, {"error": "not found"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        "处理单个HTTP连接 (每个连接一个请求)"
+        try:
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), 10.0)
+                while (line := await asyncio.wait_for(reader.readline(), 10.0)) not in (b"\r\n", b"\n", b""):
+                    pass
+            except ValueError:
+                # 请求行或请求头超出长度限制
+                status, body = HTTPStatus.BAD_REQUEST, {"error": "request line too long"}
+            else:
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    status, body = HTTPStatus.BAD_REQUEST, {"error": "bad request"}
+                else:
+                    self.metrics["requests"] += 1
+                    try:
+                        status, body = await self.dispatch(method, target)
+                    except Exception as e:
+                        status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {
+                            "error": type(e).__name__,
+                            "detail": str(e),
+                        }
+
+            if not isinstance(body, str):
+                body = json.dumps(body, ensure_ascii=False)
+            content = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + content
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_forever(self):
+        "预加载模型与底图并启动服务"
+        await asyncio.to_thread(warmup)
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.sessions.close()
@@ -0,0 +1,411 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from enum import StrEnum
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable, Iterator
+
+from pydantic import BaseModel
+
+from .schema import RESULT_MODELS, BeianQueryResp, SearchType
+
+
+class SweepStatus(StrEnum):
+    """关键词查询状态"""
+
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class ChangeType(StrEnum):
+    """备案记录变更类型"""
+
+    ADDED = "added"
+    REMOVED = "removed"
+    CHANGED = "changed"
+
+
+def record_key(record: BaseModel) -> str:
+    "备案记录标识, 网站备案为 ICP备案id:域名id, 其他为 ICP备案id"
+    if (domain_id := getattr(record, "domain_id", None)) is not None:
+        return f"{record.service_id}:{domain_id}"
+    return str(record.service_id)
+
+
+class SweepJournal:
+    """批量查询断点日志
+    基于sqlite, 记录每个关键词的状态、尝试次数与查询结果;
+    多个进程可共用同一日志文件, 通过带租期的领取操作处理互不相交的关键词;
+    查询结果按记录保存为快照, 重新查询时仅写入新增、删除或审核通过日期变化的记录, 并追加到变更流
+    """
+
+    def __init__(self, path: str | Path, lease: float = 300.0) -> None:
+        self.path = Path(path)
+        self.lease = lease
+        self.conn = sqlite3.connect(self.path, timeout=60.0, isolation_level=None)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS keywords (
+                keyword TEXT NOT NULL,
+                search_type INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                claimed_by TEXT,
+                claimed_at REAL,
+                error TEXT,
+                updated_at REAL,
+                changed_at REAL,
+                PRIMARY KEY (keyword, search_type)
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                keyword TEXT NOT NULL,
+                search_type INTEGER NOT NULL,
+                record_key TEXT NOT NULL,
+                update_record_time TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (keyword, search_type, record_key)
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                keyword TEXT NOT NULL,
+                search_type INTEGER NOT NULL,
+                record_key TEXT NOT NULL,
+                change TEXT NOT NULL,
+                data TEXT,
+                detected_at REAL NOT NULL
+            )
+            """
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        "写事务, 开始时即获取写锁"
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def add(self, keywords: Iterable[str], search_type: SearchType) -> int:
+        """添加待查询关键词, 已存在的关键词保持原状态
+        Returns:
+            int: 新增数量
+        """
+        # 全部关键词在同一事务中写入, 只提交一次
+        with self._transaction():
+            cur = self.conn.executemany(
+                "INSERT OR IGNORE INTO keywords (keyword, search_type, updated_at) VALUES (?, ?, ?)",
+                ((keyword, search_type.value, time.time()) for keyword in keywords),
+            )
+        return cur.rowcount
+
+    def claim(self, worker_id: str, max_attempts: int, limit: int = 1) -> list[tuple[str, SearchType]]:
+        """领取待查询关键词
+        Args:
+            worker_id: 工作进程标识
+            max_attempts: 最大尝试次数
+            limit: 领取数量
+        Returns:
+            list[tuple]: (关键词, 搜索类型) 列表
+        """
+        now = time.time()
+        with self._transaction():
+            # 最近有变更的关键词优先
+            rows = self.conn.execute(
+                """
+                SELECT keyword, search_type FROM keywords
+                WHERE status != 'done' AND attempts < ? AND next_attempt_at <= ?
+                    AND (claimed_by IS NULL OR claimed_at < ?)
+                ORDER BY attempts, COALESCE(changed_at, 0) DESC, next_attempt_at
+                LIMIT ?
+                """,
+                (max_attempts, now, now - self.lease, limit),
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE keywords SET claimed_by = ?, claimed_at = ? WHERE keyword = ? AND search_type = ?",
+                ((worker_id, now, keyword, search_type) for keyword, search_type in rows),
+            )
+        return [(keyword, SearchType(search_type)) for keyword, search_type in rows]
+
+    def complete(self, keyword: str, search_type: SearchType, result: BeianQueryResp) -> int:
+        """记录查询成功, 与已保存的快照比较并写入变更
+        Returns:
+            int: 变更记录数
+        """
+        now = time.time()
+        with self._transaction():
+            snapshot = dict(
+                self.conn.execute(
+                    "SELECT record_key, update_record_time FROM records WHERE keyword = ? AND search_type = ?",
+                    (keyword, search_type.value),
+                ).fetchall()
+            )
+            upserts, changes = [], []
+            for record in result.results:
+                key = record_key(record)
+                update_time = record.update_record_time.isoformat()
+                old_time = snapshot.pop(key, None)
+                if old_time == update_time:
+                    continue
+                data = record.model_dump_json(by_alias=True)
+                upserts.append((keyword, search_type.value, key, update_time, data))
+                change = ChangeType.ADDED if old_time is None else ChangeType.CHANGED
+                changes.append((key, change, data))
+            changes.extend((key, ChangeType.REMOVED, None) for key in snapshot)
+
+            self.conn.executemany(
+                """
+                INSERT INTO records (keyword, search_type, record_key, update_record_time, data)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (keyword, search_type, record_key)
+                DO UPDATE SET update_record_time = excluded.update_record_time, data = excluded.data
+                """,
+                upserts,
+            )
+            self.conn.executemany(
+                "DELETE FROM records WHERE keyword = ? AND search_type = ? AND record_key = ?",
+                (
+                    (keyword, search_type.value, key)
+                    for key, change, _ in changes
+                    if change == ChangeType.REMOVED
+                ),
+            )
+            self.conn.executemany(
+                """
+                INSERT INTO changes (keyword, search_type, record_key, change, data, detected_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                ((keyword, search_type.value, key, change.value, data, now) for key, change, data in changes),
+            )
+            self.conn.execute(
+                """
+                UPDATE keywords SET status = 'done', attempts = attempts + 1, claimed_by = NULL,
+                    error = NULL, updated_at = ?,
+                    changed_at = CASE WHEN ? THEN ? ELSE changed_at END
+                WHERE keyword = ? AND search_type = ?
+                """,
+                (now, bool(changes), now, keyword, search_type.value),
+            )
+        return len(changes)
+
+    def fail(self, keyword: str, search_type: SearchType, error: str, backoff: float):
+        """记录查询失败, 按尝试次数指数退避
+        Args:
+            backoff: 退避基础时间(秒)
+        """
+        now = time.time()
+        with self._transaction():
+            self.conn.execute(
+                """
+                UPDATE keywords SET status = 'failed', attempts = attempts + 1, claimed_by = NULL,
+                    error = ?, next_attempt_at = ? * (1 << MIN(attempts, 10)) + ?, updated_at = ?
+                WHERE keyword = ? AND search_type = ?
+                """,
+                (error, backoff, now, now, keyword, search_type.value),
+            )
+
+    def rescan(self, older_than: float = 0.0, limit: int | None = None) -> int:
+        """将已完成的关键词重新加入待查询, 最近有变更的关键词优先
+        Args:
+            older_than: 仅重新查询完成时间早于该秒数之前的关键词
+            limit: 最多重新查询的数量, 为None时不限制
+        Returns:
+            int: 重新加入的数量
+        """
+        with self._transaction():
+            cur = self.conn.execute(
+                """
+                UPDATE keywords SET status = 'pending', attempts = 0, next_attempt_at = 0, error = NULL
+                WHERE rowid IN (
+                    SELECT rowid FROM keywords WHERE status = 'done' AND updated_at <= ?
+                    ORDER BY COALESCE(changed_at, 0) DESC, updated_at
+                    LIMIT ?
+                )
+                """,
+                (time.time() - older_than, -1 if limit is None else limit),
+            )
+        return cur.rowcount
+
+    def next_retry_at(self, max_attempts: int) -> float | None:
+        """最近一个可重试关键词的重试时间, 其他进程领取中的关键词在租约到期后可重试
+        Returns:
+            float | None: 时间戳, 没有可重试的关键词时为None
+        """
+        (ts,) = self.conn.execute(
+            """
+            SELECT MIN(CASE WHEN claimed_by IS NULL THEN next_attempt_at ELSE claimed_at + ? END) FROM keywords
+            WHERE status != 'done' AND attempts < ?
+            """,
+            (self.lease, max_attempts),
+        ).fetchone()
+        return ts
+
+    def stats(self) -> dict[str, int]:
+        "各状态关键词数量"
+        counts = {status.value: 0 for status in SweepStatus}
+        counts.update(self.conn.execute("SELECT status, COUNT(*) FROM keywords GROUP BY status").fetchall())
+        return counts
+
+    def iter_results(self) -> Iterator[tuple[str, BeianQueryResp]]:
+        "遍历已完成的查询结果"
+        for keyword, search_type in self.conn.execute(
+            "SELECT keyword, search_type FROM keywords WHERE status = 'done' ORDER BY keyword"
+        ).fetchall():
+            model = RESULT_MODELS[SearchType(search_type)]
+            records = [
+                model.model_validate_json(data)
+                for (data,) in self.conn.execute(
+                    "SELECT data FROM records WHERE keyword = ? AND search_type = ? ORDER BY record_key",
+                    (keyword, search_type),
+                )
+            ]
+            yield keyword, BeianQueryResp(search_type=SearchType(search_type), results=records)
+
+    def iter_changes(self, since: int = 0) -> Iterator[dict]:
+        """遍历变更流
+        Args:
+            since: 起始序号(不含), 传入上次读取的最后序号以增量读取
+        Returns:
+            Iterator[dict]: 变更 (序号、关键词、搜索类型、记录标识、变更类型、检测时间、记录内容)
+        """
+        for seq, keyword, search_type, key, change, data, detected_at in self.conn.execute(
+            """
+            SELECT seq, keyword, search_type, record_key, change, data, detected_at FROM changes
+            WHERE seq > ? ORDER BY seq
+            """,
+            (since,),
+        ):
+            yield {
+                "seq": seq,
+                "keyword": keyword,
+                "searchType": search_type,
+                "recordKey": key,
+                "change": change,
+                "detectedAt": detected_at,
+                "record": None if data is None else json.loads(data),
+            }
+
+
+async def query_all_pages(keyword: str, search_type: SearchType, **kwargs) -> BeianQueryResp:
+    """查询全部分页并合并为完整结果, 避免只比较首页导致误报删除与新增
+    Args:
+        keyword: 关键词
+        search_type: 搜索类型
+        **kwargs: 传给 icp_query_iter 的参数
+    Returns:
+        BeianQueryResp: 全部分页的查询结果 (按记录标识去重)
+    """
+    from . import icp_query_iter
+
+    records = {}
+    async for page in icp_query_iter(keyword, (search_type,), **kwargs):
+        for record in page.results:
+            records.setdefault(record_key(record), record)
+    return BeianQueryResp(search_type=search_type, results=list(records.values()))
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def run_sweep(
+    journal: SweepJournal,
+    query: Callable[[str, SearchType], Awaitable[BeianQueryResp]],
+    concurrency: int = 1,
+    max_attempts: int = 5,
+    backoff: float = 30.0,
+    worker_id: str | None = None,
+    callback: Callable[[str, SearchType, BaseException | None], None] = None,
+    poll_interval: float = 5.0,
+):
+    """执行批量查询, 跳过已完成的关键词, 失败的关键词退避后重试
+    Args:
+        journal: 断点日志
+        query: 查询函数, 需返回全部分页的结果, 如 query_all_pages
+        concurrency: 本进程并发数
+        max_attempts: 每个关键词最大尝试次数
+        backoff: 失败退避基础时间(秒)
+        worker_id: 工作进程标识
+        callback: 单个关键词完成回调
+        poll_interval: 无可领取关键词时重新检查的最长间隔(秒)
+    """
+    worker_id = worker_id or default_worker_id()
+
+    async def worker():
+        while True:
+            claimed = journal.claim(worker_id, max_attempts)
+            if not claimed:
+                retry_at = journal.next_retry_at(max_attempts)
+                if retry_at is None:
+                    return
+                # 同一进程内其他协程领取的关键词可能很快完成, 等待时间不超过轮询间隔
+                await asyncio.sleep(min(max(retry_at - time.time(), 0.0), poll_interval) + 0.1)
+                continue
+
+            keyword, search_type = claimed[0]
+            try:
+                result = await query(keyword, search_type)
+            except Exception as e:
+                # 接口返回结构变化等未预期的错误同样记录失败, 不中断整个批量查询
+                journal.fail(keyword, search_type, f"{type(e).__name__}:{e}", backoff)
+                error = e
+            else:
+                journal.complete(keyword, search_type, result)
+                error = None
+            if callable(callback):
+                callback(keyword, search_type, error)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def export_results(journal: SweepJournal, path: str | Path):
+    "导出已完成的查询结果为JSON Lines"
+    with open(path, "w", encoding="utf-8") as f:
+        for keyword, result in journal.iter_results():
+            f.write(
+                json.dumps(
+                    {"keyword": keyword, **result.model_dump(mode="json", by_alias=True)}, ensure_ascii=False
+                )
+            )
+            f.write("\n")
+
+
+def export_changes(journal: SweepJournal, path: str | Path, since: int = 0) -> int:
+    """导出变更流为JSON Lines
+    Args:
+        since: 起始序号(不含)
+    Returns:
+        int: 最后导出的序号, 可作为下次导出的起始序号
+    """
+    last = since
+    with open(path, "w", encoding="utf-8") as f:
+        for change in journal.iter_changes(since):
+            f.write(json.dumps(change, ensure_ascii=False))
+            f.write("\n")
+            last = change["seq"]
+    return last
@@ -1,9 +1,13 @@
 import asyncio
+import time
 from typing import Callable
 
-from .captcha import fuck_captcha
+from .captcha import SolveTrace, fuck_captcha
+from .corpus import CaptchaCorpus, CaptchaOutcome, default_corpus
+from .deadline import Deadline
 from .dto import AsyncIcpQueryDto
 from .exceptions import FuckCaptchaFail
+from .profiling import stage
 
 
 async def resolve_captcha(
@@ -11,6 +15,8 @@ async def resolve_captcha(
     callback: Callable[[int], None] = None,
     max_retry: int = 10,
     fail_delay: float = 5.0,
+    deadline: Deadline | None = None,
+    corpus: CaptchaCorpus | None = None,
 ):
     """自动处理验证码
     Args:
@@ -18,21 +24,44 @@ async def resolve_captcha(
         callback: 验证码识别回调
         max_retry: 验证码识别最大重试次数
         fail_delay: 验证码识别失败重试等待时间
+        deadline: 总耗时预算, 为None时使用 dto.deadline;
+            重试等待不超过剩余时间, 剩余时间不足以完成下一次尝试时抛出 ICPQueryTimeout
+        corpus: 记录识别失败与抽样的成功样本, 为None时使用环境变量 ICPQUERY_CAPTCHA_CORPUS 指定的样本库
     """
+    deadline = deadline or dto.deadline or Deadline()
+    if corpus is None:
+        corpus = default_corpus()
+    # 上一次尝试的耗时, 用于估计下一次尝试能否在预算内完成
+    attempt_cost = 0.0
     for retry_cnt in range(max_retry):
+        deadline.check(attempt_cost)
+        if retry_cnt:
+            with stage("captcha_fail_delay"):
+                await asyncio.sleep(deadline.cap(fail_delay, reserve=attempt_cost))
         if callable(callback):
             callback(retry_cnt)
 
-        captcha = await dto.get_captcha()
+        start = time.monotonic()
+        with stage("get_captcha"):
+            captcha = await dto.get_captcha()
 
-        points = await asyncio.to_thread(fuck_captcha, captcha)
+        trace = None if corpus is None else SolveTrace()
+        with stage("fuck_captcha"):
+            async with deadline.limit():
+                points = await asyncio.to_thread(fuck_captcha, captcha, trace)
         if points is None:
-            await asyncio.sleep(fail_delay)
+            if corpus is not None:
+                await asyncio.to_thread(corpus.record, captcha, CaptchaOutcome.UNSOLVED, trace)
+            attempt_cost = time.monotonic() - start
             continue
 
-        if await dto.check_captcha(points):
+        with stage("check_captcha"):
+            passed = await dto.check_captcha(points)
+        if corpus is not None:
+            outcome = CaptchaOutcome.PASSED if passed else CaptchaOutcome.REJECTED
+            await asyncio.to_thread(corpus.record, captcha, outcome, trace)
+        if passed:
             return
-
-        await asyncio.sleep(fail_delay)
+        attempt_cost = time.monotonic() - start
     else:
         raise FuckCaptchaFail
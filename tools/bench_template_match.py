@@ -0,0 +1,101 @@
+"""评估模板匹配快速路径阈值
+获取线上验证码, 对比不同阈值下快速路径的覆盖率(跳过孪生网络的文字比例)与其判定结果和孪生网络的一致率
+
+用法: python tools/bench_template_match.py [验证码数量]
+"""
+
+import asyncio
+import itertools
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from icpquery.captcha import (
+    TemplateMatchConfig,
+    binarize_glyph,
+    detect_bg_type,
+    find_roi_boxes,
+    get_siamese_model,
+    load_bg_img,
+    preprocess_bg,
+    preprocess_ptr,
+    roi_crop_box,
+    spilt_pointer_img,
+    template_match_decide,
+    template_score_matrix,
+    to_model_input,
+)
+from icpquery.dto import AsyncIcpQueryDto
+
+ACCEPTS = [0.7, 0.75, 0.8, 0.85, 0.9]
+MARGINS = [0.1, 0.15, 0.2, 0.25, 0.3]
+GLYPH_SIZE = TemplateMatchConfig.size
+
+
+def score_captcha(captcha) -> tuple[np.ndarray, np.ndarray, float, float] | None:
+    "计算一张验证码的模板匹配得分与孪生网络得分"
+    bg_img = cv2.imdecode(np.frombuffer(captcha.bg_img_data, np.uint8), cv2.IMREAD_COLOR)
+    ptr_img = cv2.imdecode(np.frombuffer(captcha.ptr_img_data, np.uint8), cv2.IMREAD_COLOR)
+    bg_type = detect_bg_type(bg_img)
+    if bg_type is None:
+        return None
+    bufs = preprocess_bg(bg_img, load_bg_img(bg_type))
+    needles = spilt_pointer_img(preprocess_ptr(ptr_img))
+    hs_h, hs_w, _ = bufs.tensor.shape
+    parts = []
+    for roi_box in find_roi_boxes(bufs.fg_mask):
+        x, y, w, h = roi_crop_box(roi_box, hs_h, hs_w)
+        parts.append(bufs.tensor[y : y + h, x : x + w])
+    if not parts:
+        return None
+
+    start = time.perf_counter()
+    tm_scores = template_score_matrix(
+        [binarize_glyph(p, GLYPH_SIZE) for p in parts],
+        [binarize_glyph(p, GLYPH_SIZE) for p in needles],
+    )
+    tm_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    nn_scores = get_siamese_model().score_matrix(
+        [to_model_input(p) for p in parts],
+        [to_model_input(p) for p in needles],
+    )
+    nn_time = time.perf_counter() - start
+    return tm_scores, nn_scores, tm_time, nn_time
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    samples = []
+    async with AsyncIcpQueryDto() as dto:
+        await dto.get_token()
+        while len(samples) < count:
+            result = score_captcha(await dto.get_captcha())
+            if result is not None:
+                samples.append(result)
+                print(f"\r{len(samples)}/{count}", end="")
+    print()
+    print(f"template match {np.mean([s[2] for s in samples]) * 1000:.2f}ms/captcha")
+    print(f"siamese        {np.mean([s[3] for s in samples]) * 1000:.2f}ms/captcha")
+
+    print("accept margin  coverage agreement")
+    for accept, margin in itertools.product(ACCEPTS, MARGINS):
+        config = TemplateMatchConfig(accept=accept, margin=margin, size=GLYPH_SIZE)
+        decided_cnt = agree_cnt = total = 0
+        for tm_scores, nn_scores, _, _ in samples:
+            decided, _ = template_match_decide(tm_scores, config)
+            total += len(tm_scores)
+            decided_cnt += len(decided)
+            agree_cnt += sum(
+                1 for i, j in decided.items() if nn_scores[i].argmax() == j and nn_scores[i, j] > 0.6
+            )
+        print(
+            f"{accept:6.2f} {margin:6.2f} {decided_cnt / total:9.1%} "
+            f"{agree_cnt / decided_cnt if decided_cnt else float('nan'):9.1%}"
+        )
+
+
+asyncio.run(main())
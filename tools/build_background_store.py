@@ -0,0 +1,13 @@
+"""将 icpquery/backgrounds/ 下的全部底图模板打包为可内存映射的 icpquery/backgrounds.npy
+
+用法: python tools/build_background_store.py [输出路径]
+"""
+
+import sys
+from pathlib import Path
+
+from icpquery.captcha import BACKGROUND_STORE_PATH, build_background_store
+
+if __name__ == "__main__":
+    path = build_background_store(Path(sys.argv[1]) if len(sys.argv) > 1 else BACKGROUND_STORE_PATH)
+    print("saved", path, path.with_suffix(".json"))
@@ -0,0 +1,65 @@
+"""将 ONNX 模型导出为 NumPy 推理后端使用的同名 .npz 文件 (权重 + 计算图)
+
+用法: python tools/export_numpy_model.py [模型文件...]
+默认导出 icpquery/models/ 下的全部 .onnx 模型
+依赖: onnx (仅此工具需要)
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import onnx
+from onnx import helper, numpy_helper
+
+MODULES_PATH = Path(__file__).parent.parent / "icpquery" / "models"
+
+
+def attr_value(attr: onnx.AttributeProto):
+    value = helper.get_attribute_value(attr)
+    if isinstance(value, bytes):
+        return value.decode()
+    if isinstance(value, onnx.TensorProto):
+        return numpy_helper.to_array(value).tolist()
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return value
+
+
+def export(model_file: Path):
+    model = onnx.load(model_file)
+    graph = model.graph
+    tensors = {init.name: numpy_helper.to_array(init) for init in graph.initializer}
+    initializer_names = set(tensors)
+
+    nodes = []
+    for node in graph.node:
+        if node.op_type == "Constant":
+            # 常量节点转为权重
+            tensors[node.output[0]] = numpy_helper.to_array(helper.get_attribute_value(node.attribute[0]))
+            continue
+        nodes.append(
+            {
+                "op": node.op_type,
+                "inputs": list(node.input),
+                "outputs": list(node.output),
+                "attrs": {attr.name: attr_value(attr) for attr in node.attribute},
+            }
+        )
+
+    graph_json = {
+        "inputs": [i.name for i in graph.input if i.name not in initializer_names],
+        "outputs": [o.name for o in graph.output],
+        "nodes": nodes,
+    }
+    tensors["__graph__"] = np.frombuffer(json.dumps(graph_json).encode(), np.uint8)
+    out_file = model_file.with_suffix(".npz")
+    np.savez(out_file, **tensors)
+    print("saved", out_file)
+
+
+if __name__ == "__main__":
+    files = [Path(f) for f in sys.argv[1:]] or sorted(MODULES_PATH.glob("*.onnx"))
+    for f in files:
+        export(f)
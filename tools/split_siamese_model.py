@@ -0,0 +1,88 @@
+"""将孪生网络模型拆分为编码器(图片 -> 特征向量)与相似度头(特征向量对 -> 相似度)
+
+用法: python tools/split_siamese_model.py [siamese.onnx] [输出目录]
+依赖: onnx (仅此工具需要)
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import onnx
+from onnx.utils import Extractor
+from onnxruntime import InferenceSession
+
+MODULES_PATH = Path(__file__).parent.parent / "icpquery" / "models"
+
+# 原模型的两个分支输入: 底图ROI区域 / 点选文字
+HAYSTACK_INPUT = "input"
+NEEDLE_INPUT = "input.53"
+
+
+def find_embeddings(model: onnx.ModelProto) -> tuple[str, str]:
+    """查找两个分支汇合处的特征向量张量名
+    Returns:
+        tuple[str, str]: (底图分支特征向量, 文字分支特征向量)
+    """
+    deps: dict[str, frozenset[str]] = {
+        HAYSTACK_INPUT: frozenset({HAYSTACK_INPUT}),
+        NEEDLE_INPUT: frozenset({NEEDLE_INPUT}),
+    }
+    embeddings = {}
+    for node in model.graph.node:
+        node_deps = frozenset().union(*(deps.get(name, frozenset()) for name in node.input))
+        if len(node_deps) == 2:
+            for name in node.input:
+                if len(tensor_deps := deps.get(name, frozenset())) == 1:
+                    embeddings.setdefault(next(iter(tensor_deps)), name)
+        for name in node.output:
+            deps[name] = node_deps
+    if len(embeddings) != 2:
+        raise ValueError(f"无法定位特征向量张量: {embeddings}")
+    return embeddings[HAYSTACK_INPUT], embeddings[NEEDLE_INPUT]
+
+
+def rename_tensor(model: onnx.ModelProto, old: str, new: str):
+    "重命名模型中的张量"
+    for node in model.graph.node:
+        node.input[:] = [new if name == old else name for name in node.input]
+        node.output[:] = [new if name == old else name for name in node.output]
+    for value in (*model.graph.input, *model.graph.output):
+        if value.name == old:
+            value.name = new
+
+
+def main():
+    src = Path(sys.argv[1]) if len(sys.argv) > 1 else MODULES_PATH / "siamese.onnx"
+    dst = Path(sys.argv[2]) if len(sys.argv) > 2 else src.parent
+
+    model = onnx.shape_inference.infer_shapes(onnx.load(src))
+    emb_a, emb_b = find_embeddings(model)
+    print("embeddings:", emb_a, emb_b)
+
+    extractor = Extractor(model)
+    outputs = [value.name for value in model.graph.output]
+    encoder = extractor.extract_model([HAYSTACK_INPUT], [emb_a])
+    needle_encoder = extractor.extract_model([NEEDLE_INPUT], [emb_b])
+    head = extractor.extract_model([emb_a, emb_b], outputs)
+
+    rename_tensor(encoder, emb_a, "embedding")
+    rename_tensor(needle_encoder, emb_b, "embedding")
+    rename_tensor(head, emb_a, "embedding_a")
+    rename_tensor(head, emb_b, "embedding_b")
+    rename_tensor(head, outputs[0], "output")
+
+    # 校验两个分支共享权重, 才能使用同一个编码器
+    x = np.random.default_rng(0).random((1, 3, 105, 105), np.float32)
+    emb = InferenceSession(encoder.SerializeToString()).run(None, {HAYSTACK_INPUT: x})[0]
+    needle_emb = InferenceSession(needle_encoder.SerializeToString()).run(None, {NEEDLE_INPUT: x})[0]
+    if not np.allclose(emb, needle_emb, atol=1e-5):
+        raise ValueError("两个分支权重不一致, 无法拆分为共享编码器")
+
+    onnx.save(encoder, dst / "siamese_encoder.onnx")
+    onnx.save(head, dst / "siamese_head.onnx")
+    print("saved", dst / "siamese_encoder.onnx", dst / "siamese_head.onnx")
+
+
+if __name__ == "__main__":
+    main()